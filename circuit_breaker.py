@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    # guards calls to a service that may be down, use it as `with breaker:` around a call
+    # any exception raised inside counts as a failure of the service, unless failure_exceptions says which ones do
+    # others (like bugs on our side) count as neither a failure nor a success
+    # after failure_threshold failures in a row, calls fail right away with CircuitOpenError for reset_timeout seconds
+    # then a single call is let through to probe the service: if it works, the breaker closes again,
+    # if not, it stays open twice as long as before, up to max_reset_timeout
+    def __init__(self, name, failure_threshold=5, reset_timeout=5, max_reset_timeout=300, on_state_change=None, failure_exceptions=(Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.on_state_change = on_state_change
+        self.failure_exceptions = failure_exceptions
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.open_timeout = reset_timeout
+        self.open_until = 0
+
+    def __enter__(self):
+        with self.lock:
+            if self.state == "closed":
+                return self
+            if self.state == "half_open":
+                raise CircuitOpenError(f"{self.name} is unavailable, waiting to see if it is back")
+            now = time.monotonic()
+            if now < self.open_until:
+                raise CircuitOpenError(f"{self.name} is unavailable, not trying again for {self.open_until - now:.1f} seconds")
+            # this call is the probe
+            self.set_state("half_open")
+            return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.record_success()
+        elif issubclass(exception_type, self.failure_exceptions):
+            self.record_failure()
+        else:
+            # cancelled or not the service's fault, we don't know how the service is doing, let the next call probe it
+            with self.lock:
+                if self.state == "half_open":
+                    self.open_until = 0
+                    self.set_state("open")
+        return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_timeout = self.reset_timeout
+            if self.state != "closed":
+                logger.info(f"{self.name} is available again")
+                self.set_state("closed")
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self.open_timeout = min(self.open_timeout * 2, self.max_reset_timeout)
+            elif self.state != "closed" or self.failures < self.failure_threshold:
+                return
+            self.open_until = time.monotonic() + self.open_timeout
+            logger.warning(f"{self.name} failed {self.failures} times in a row, failing calls to it for {self.open_timeout} seconds")
+            self.set_state("open")
+
+    def set_state(self, state):
+        self.state = state
+        if self.on_state_change:
+            self.on_state_change(self.name, state)
+
+    def get_status(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": max(self.open_until - time.monotonic(), 0) if self.state == "open" else None
+            }
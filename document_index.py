@@ -0,0 +1,239 @@
+import logging
+import math
+import re
+import sys
+from collections import Counter
+import numpy as np
+from keyword_router import KeywordRouter
+
+logger = logging.getLogger(__name__)
+
+def tokenize(text):
+    # entity IDs like light.office_overhead_left are kept whole and also split into their words
+    # so they match both when spelled out exactly and when the user just says "office overhead left"
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+(?:[._][a-z0-9]+)*', text.lower()):
+        tokens.append(token)
+        if '.' in token or '_' in token:
+            tokens.extend(re.split(r'[._]', token))
+    return tokens
+
+def get_size(value, seen=None):
+    # sys.getsizeof of the value and everything in it, counting objects referenced more than once only once
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(get_size(key, seen) + get_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(get_size(item, seen) for item in value)
+    elif isinstance(value, np.ndarray):
+        size = value.nbytes
+    return size
+
+class DocumentSegment:
+    # the documents of a single plugin, with their embeddings normalized and stacked into one float32 matrix
+    # the documents themselves don't keep their embeddings, and once it is built, the core takes them out of
+    # the documents the plugin returned too, so every embedding is stored exactly once
+    # documents without a usable embedding (e.g. because the embedding API was down) have no row in the matrix,
+    # embedded holds the index of the document every row belongs to, they can still be found by keywords and BM25
+    # this is rebuilt whenever the plugin finishes an update, never on the request path
+    def __init__(self, plugin_name, documents, matrix=None, embedded=None, previous=None):
+        self.plugin_name = plugin_name
+        if matrix is not None:
+            # documents and their already normalized embeddings, as stored by SegmentStore
+            self.documents = documents
+            self.matrix = matrix
+            self.embedded = np.arange(len(matrix), dtype=np.int64) if embedded is None else np.asarray(embedded, dtype=np.int64)
+            self.term_frequencies = [Counter(tokenize(document['title'])) for document in self.documents]
+            return
+        self.documents = []
+        embeddings = []
+        embedded = []
+        # documents returned again after their embedding was taken out keep the one of the previous segment
+        previous_embeddings = previous.get_embeddings_by_title() if previous is not None else {}
+        for document in documents or []:
+            # a copy, so a plugin reusing its document dictionaries can't change what requests are reading
+            self.documents.append({key: value for key, value in document.items() if key != 'embedding'})
+            if 'embedding' not in document and document.get('title') in previous_embeddings:
+                embedding = previous_embeddings[document['title']]
+                if embeddings and embedding.shape != embeddings[0].shape:
+                    embedding = None
+            else:
+                embedding = self.get_embedding(plugin_name, document, embeddings[0].shape if embeddings else None)
+            if embedding is not None:
+                embeddings.append(embedding)
+                embedded.append(len(self.documents) - 1)
+        self.embedded = np.array(embedded, dtype=np.int64)
+        # term frequencies for BM25, so the lexical index is only ever rebuilt for the plugin that updated
+        self.term_frequencies = [Counter(tokenize(document['title'])) for document in self.documents]
+        if embeddings:
+            self.matrix = np.stack(embeddings)
+        else:
+            self.matrix = np.empty((0, 0), dtype=np.float32)
+
+    def get_embedding(self, plugin_name, document, shape):
+        # the normalized embedding of the document, or None if it has no usable one
+        title = document.get('title')
+        if document.get('embedding') is None:
+            logger.warning(f'Document "{title}" of plugin {plugin_name} could not be embedded, it can only be found by its words')
+            return None
+        try:
+            embedding = np.asarray(document['embedding'], dtype=np.float32)
+        except (TypeError, ValueError):
+            logger.warning(f'Document "{title}" of plugin {plugin_name} has no valid embedding, it can only be found by its words')
+            return None
+        if embedding.ndim != 1 or embedding.size == 0 or (shape is not None and embedding.shape != shape):
+            logger.warning(f'Document "{title}" of plugin {plugin_name} has an embedding with an unexpected shape {embedding.shape}, it can only be found by its words')
+            return None
+        norm = np.linalg.norm(embedding)
+        if not norm:
+            logger.warning(f'Document "{title}" of plugin {plugin_name} has an embedding that is all zeroes, it can only be found by its words')
+            return None
+        return embedding / norm
+
+    def get_embeddings_by_title(self):
+        return {self.documents[i].get('title'): self.matrix[row] for row, i in enumerate(self.embedded)}
+
+    def get_memory_usage(self):
+        # bytes used by the embeddings and an estimate of the bytes used by the documents and everything in them
+        # memory-mapped embeddings are in the page cache, shared by every process mapping them
+        mapped = isinstance(self.matrix, np.memmap)
+        return {
+            "embeddings": 0 if mapped else self.matrix.nbytes,
+            "mapped_embeddings": self.matrix.nbytes if mapped else 0,
+            "documents": get_size(self.documents)
+        }
+
+class DocumentIndex:
+    # all documents a user can query, scored against the pre-normalized float32 matrix of every plugin
+    # the matrices are shared with the segments instead of stacked, so indexes of users sharing a plugin don't copy its embeddings
+    def __init__(self, segments):
+        self.documents = []
+        self.plugin_names = []
+        term_frequencies = []
+        self.matrices = []
+        # the index of the document every row of the matrices belongs to
+        embedded = []
+        for segment in segments:
+            if segment is None or not segment.documents:
+                continue
+            if len(segment.matrix):
+                if self.matrices and segment.matrix.shape[1] != self.matrices[0].shape[1]:
+                    logger.warning(f'Documents of plugin {segment.plugin_name} can only be found by their words as their embeddings have {segment.matrix.shape[1]} dimensions instead of {self.matrices[0].shape[1]}')
+                else:
+                    self.matrices.append(segment.matrix)
+                    embedded.append(segment.embedded + len(self.documents))
+            self.documents.extend(segment.documents)
+            self.plugin_names.extend([segment.plugin_name] * len(segment.documents))
+            term_frequencies.extend(segment.term_frequencies)
+        self.embedded = np.concatenate(embedded) if embedded else np.array([], dtype=np.int64)
+        self.build_lexical_index(term_frequencies)
+        # documents can name things the user is likely to say literally, like area names
+        self.keyword_router = KeywordRouter()
+        for i, document in enumerate(self.documents):
+            for keyword in document.get('keywords', []):
+                self.keyword_router.add(keyword, i)
+        self.keyword_router.build()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def build_lexical_index(self, term_frequencies, k1=1.2, b=0.75):
+        # BM25 inverted index over the document titles
+        # each term maps to the documents it appears in and its precomputed BM25 weight in each of them
+        document_lengths = np.array([sum(frequencies.values()) for frequencies in term_frequencies], dtype=np.float32)
+        average_length = float(document_lengths.mean()) if len(document_lengths) and document_lengths.mean() else 1.0
+        postings = {}
+        for i, frequencies in enumerate(term_frequencies):
+            for term, frequency in frequencies.items():
+                postings.setdefault(term, []).append((i, frequency))
+        self.postings = {}
+        for term, term_postings in postings.items():
+            document_indexes = np.array([i for i, _ in term_postings], dtype=np.int64)
+            frequencies = np.array([frequency for _, frequency in term_postings], dtype=np.float32)
+            idf = math.log(1 + (len(term_frequencies) - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            weights = idf * frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * document_lengths[document_indexes] / average_length))
+            self.postings[term] = (document_indexes, weights.astype(np.float32))
+
+    def get_lexical_scores(self, prompt):
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in set(tokenize(prompt)):
+            if term in self.postings:
+                document_indexes, weights = self.postings[term]
+                scores[document_indexes] += weights
+        return scores
+
+    def get_top(self, scores, count):
+        count = min(count, len(scores))
+        if count <= 0:
+            return np.array([], dtype=np.int64)
+        if count < len(scores):
+            top = np.argpartition(-scores, count - 1)[:count]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def get_similarities(self, prompt_embedding):
+        query = np.asarray(prompt_embedding, dtype=np.float32)
+        if query.shape != (self.matrices[0].shape[1],):
+            raise ValueError(f"prompt embedding has shape {query.shape}, expected ({self.matrices[0].shape[1]},)")
+        norm = np.linalg.norm(query)
+        if not norm:
+            raise ValueError("prompt embedding is all zeroes")
+        query = query / norm
+        # documents without an embedding are never similar
+        similarities = np.full(len(self.documents), -np.inf, dtype=np.float32)
+        similarities[self.embedded] = np.concatenate([matrix @ query for matrix in self.matrices])
+        return similarities
+
+    def get_result(self, i, similarity, score):
+        return {
+            "document": self.documents[i],
+            "similarity": similarity,
+            "score": score,
+            "plugin_name": self.plugin_names[i]
+        }
+
+    def search_lexical(self, prompt, number_of_results):
+        if not self.documents or number_of_results <= 0:
+            return []
+        scores = self.get_lexical_scores(prompt)
+        top = [i for i in self.get_top(scores, number_of_results) if scores[i] > 0]
+        return [self.get_result(i, None, float(scores[i])) for i in top]
+
+    def search_hybrid(self, prompt, prompt_embedding, number_of_results, rrf_k=60, candidates=50):
+        # reciprocal rank fusion of the vector and BM25 rankings
+        # only the top candidates of each ranking take part, everything below them would barely contribute anyway
+        if not self.matrices or number_of_results <= 0:
+            return []
+        similarities = self.get_similarities(prompt_embedding)
+        lexical_scores = self.get_lexical_scores(prompt)
+        candidate_count = max(number_of_results, candidates)
+        fused_scores = {}
+        vector_top = [i for i in self.get_top(similarities, candidate_count) if np.isfinite(similarities[i])]
+        for rank, i in enumerate(vector_top):
+            fused_scores[i] = fused_scores.get(i, 0) + 1 / (rrf_k + rank + 1)
+        lexical_top = [i for i in self.get_top(lexical_scores, candidate_count) if lexical_scores[i] > 0]
+        for rank, i in enumerate(lexical_top):
+            fused_scores[i] = fused_scores.get(i, 0) + 1 / (rrf_k + rank + 1)
+        top = sorted(fused_scores, key=lambda i: fused_scores[i], reverse=True)[:number_of_results]
+        return [self.get_result(i, float(similarities[i]) if np.isfinite(similarities[i]) else None, fused_scores[i]) for i in top]
+
+    def search(self, prompt_embedding, number_of_results):
+        if not self.matrices or number_of_results <= 0:
+            return []
+        similarities = self.get_similarities(prompt_embedding)
+        top = [i for i in self.get_top(similarities, number_of_results) if np.isfinite(similarities[i])]
+        return [self.get_result(i, float(similarities[i]), float(similarities[i])) for i in top]
+
+    def route(self, prompt, number_of_results):
+        # selects the documents whose keywords appear in the prompt, without needing an embedding
+        if not len(self.keyword_router) or number_of_results <= 0:
+            return []
+        results = []
+        for i in dict.fromkeys(self.keyword_router.search(prompt)):
+            results.append(self.get_result(i, 1.0, 1.0))
+        return results[:number_of_results]
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    # gathers the texts that are embedded concurrently within window seconds (or until max_batch_size of them are waiting)
+    # and embeds them with a single request, every caller then gets its own embedding back
+    # it belongs to the event loop it was created in
+    def __init__(self, embed_batch, window, max_batch_size, on_batch=None):
+        self.embed_batch = embed_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.on_batch = on_batch
+        self.loop = asyncio.get_running_loop()
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def embed(self, text):
+        future = self.loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.pending
+        self.pending = []
+        if batch:
+            # keep a reference to the task, the event loop only keeps a weak one
+            task = self.loop.create_task(self.send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        if self.on_batch:
+            self.on_batch(len(texts))
+        try:
+            embeddings = await self.embed_batch(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        embeddings_by_text = dict(zip(texts, embeddings))
+        for text, future in batch:
+            # requests that were cancelled in the meantime don't need their embedding anymore
+            if not future.done():
+                future.set_result(embeddings_by_text[text])
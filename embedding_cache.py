@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    # persistent cache of embeddings keyed by the embedding model and a hash of the text
+    # embeddings are stored as float32 blobs and the least recently used ones are evicted past max_entries
+    # reads never write: when entries were last used is remembered in memory and written with the next put
+    # several processes can share the file, so the entries are counted in the database every check_interval puts
+    def __init__(self, path, max_entries, check_interval=100):
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+        self.pending_touches = {}
+        logger.info(f"Loaded embedding cache from {path} with {self.count()} entries")
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_text_hash(self, text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, model, text):
+        text_hash = self.get_text_hash(text)
+        with self.lock:
+            row = self.connection.execute("SELECT embedding FROM embeddings WHERE model = ? AND text_hash = ?", (model, text_hash)).fetchone()
+            if row is None:
+                return None
+            self.pending_touches[(model, text_hash)] = time.time()
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def write_touches(self):
+        if self.pending_touches:
+            self.connection.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                        [(last_used, model, text_hash) for (model, text_hash), last_used in self.pending_touches.items()])
+            self.pending_touches = {}
+
+    def put(self, model, text, embedding):
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        text_hash = self.get_text_hash(text)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO embeddings (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)", (model, text_hash, blob, time.time()))
+            # before evicting, so entries that were just read aren't evicted
+            self.write_touches()
+            self.puts += 1
+            if self.puts % self.check_interval == 0:
+                self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # evict down to nine tenths of the cache at once so we don't have to do this on every check
+        entries = self.count()
+        if entries <= self.max_entries:
+            return
+        target = int(self.max_entries * 0.9)
+        self.connection.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)", (entries - target,))
+        logger.debug(f"Evicted {entries - target} entries from the embedding cache")
+
+class QueryEmbeddingCache:
+    # in-memory LRU cache of prompt embeddings, as voice users tend to say the same things over and over
+    # prompts are normalized so "Turn off the lights." and "turn off the lights" share an entry
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def normalize(self, text):
+        return ' '.join(text.lower().split()).strip('.?!, ')
+
+    def get(self, model, text):
+        key = (model, self.normalize(text))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, model, text, embedding):
+        key = (model, self.normalize(text))
+        with self.lock:
+            self.entries[key] = (embedding, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
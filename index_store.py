@@ -0,0 +1,84 @@
+import glob
+import logging
+import os
+import pickle
+import time
+import numpy as np
+from document_index import DocumentSegment
+
+logger = logging.getLogger(__name__)
+
+class SegmentStore:
+    # keeps the document segment of every plugin instance on disk, so a restarted server can answer
+    # requests with the last known documents right away instead of waiting for every plugin to update
+    # embeddings are stored as .npy matrices, everything else about the documents is pickled next to them
+    # the pickle names the matrix that belongs to it, so replacing the pickle publishes a new version at once
+    # and readers that memory-map a matrix can keep using it after it was replaced
+    # documents are only loaded by the same version of the plugin that stored them, as plugins may change what their documents contain
+    def __init__(self, directory, embedding_model):
+        self.directory = directory
+        self.embedding_model = embedding_model
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, plugin_key):
+        module_name, config_hash = plugin_key
+        return os.path.join(self.directory, f"{module_name}-{config_hash[:16]}")
+
+    def save(self, plugin_key, plugin_version, segment, updated):
+        path = self.get_path(plugin_key)
+        matrix_path = f"{path}.{time.time_ns()}.npy"
+        metadata = {
+            "embedding_model": self.embedding_model,
+            "plugin_key": plugin_key,
+            "plugin_version": plugin_version,
+            "updated": updated,
+            "matrix_file": os.path.basename(matrix_path),
+            "documents": segment.documents,
+            "embedded": segment.embedded
+        }
+        # write to temporary files and rename them, so a crash never leaves half a file behind
+        with open(matrix_path + '.tmp', 'wb') as f:
+            np.save(f, segment.matrix)
+        os.replace(matrix_path + '.tmp', matrix_path)
+        with open(path + '.pickle.tmp', 'wb') as f:
+            pickle.dump(metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.pickle.tmp', path + '.pickle')
+        for old_matrix_path in glob.glob(glob.escape(path) + '.*.npy'):
+            if old_matrix_path != matrix_path:
+                try:
+                    os.remove(old_matrix_path)
+                except OSError:
+                    # still mapped by a reader on a platform that doesn't allow removing it, try again next time
+                    pass
+
+    def get_version(self, plugin_key):
+        # changes whenever a new version of the documents is saved, cheap enough to check often
+        try:
+            return os.stat(self.get_path(plugin_key) + '.pickle').st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self, plugin_key, plugin_name, plugin_version, memory_map=False):
+        # returns the stored segment and when it was updated, or None if there is no usable one
+        # with memory_map, the matrix is mapped read-only instead of read, so processes loading it share its memory
+        path = self.get_path(plugin_key)
+        if not os.path.exists(path + '.pickle'):
+            return None
+        try:
+            with open(path + '.pickle', 'rb') as f:
+                metadata = pickle.load(f)
+            matrix = np.load(os.path.join(self.directory, metadata['matrix_file']), mmap_mode='r' if memory_map else None)
+        except Exception as e:
+            logger.error(f"Could not load the stored documents of plugin {plugin_name} from {path}: {str(e)}")
+            return None
+        if metadata['embedding_model'] != self.embedding_model or metadata['plugin_key'] != tuple(plugin_key):
+            logger.info(f"Ignoring the stored documents of plugin {plugin_name} as they were created with a different configuration")
+            return None
+        if metadata.get('plugin_version') != plugin_version:
+            logger.info(f"Ignoring the stored documents of plugin {plugin_name} as they were created by a different version of it")
+            return None
+        embedded = metadata['embedded']
+        if len(embedded) != len(matrix) or (len(embedded) and embedded.max() >= len(metadata['documents'])):
+            logger.warning(f"Ignoring the stored documents of plugin {plugin_name} as they don't match their embeddings")
+            return None
+        return DocumentSegment(plugin_name, metadata['documents'], matrix, embedded), metadata['updated']
@@ -0,0 +1,67 @@
+import re
+from collections import deque
+
+def normalize_text(text):
+    # lowercase words separated by single spaces, padded so keywords only ever match whole words
+    return ' ' + ' '.join(re.sub(r'[^a-z0-9]+', ' ', text.lower()).split()) + ' '
+
+class KeywordRouter:
+    # Aho-Corasick automaton over the names and aliases of documents
+    # finds every keyword in a prompt in a single pass, no matter how many keywords there are
+    def __init__(self, minimum_length=3):
+        self.minimum_length = minimum_length
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]
+        self.keyword_count = 0
+
+    def __len__(self):
+        return self.keyword_count
+
+    def add(self, keyword, value):
+        keyword = normalize_text(keyword)
+        if len(keyword.strip()) < self.minimum_length:
+            return
+        node = 0
+        for character in keyword:
+            if character not in self.transitions[node]:
+                self.transitions.append({})
+                self.failures.append(0)
+                self.outputs.append([])
+                self.transitions[node][character] = len(self.transitions) - 1
+            node = self.transitions[node][character]
+        self.outputs[node].append((len(keyword), value))
+        self.keyword_count += 1
+
+    def build(self):
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for character, child in self.transitions[node].items():
+                queue.append(child)
+                failure = self.failures[node]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[child] = self.transitions[failure].get(character, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.failures[child]]
+
+    def search(self, text):
+        # returns the values of all matched keywords in order of appearance
+        # when keywords overlap (e.g. "kitchen" and "kitchen speaker"), only the longest one counts
+        text = normalize_text(text)
+        matches = []
+        node = 0
+        for position, character in enumerate(text):
+            while node and character not in self.transitions[node]:
+                node = self.failures[node]
+            node = self.transitions[node].get(character, 0)
+            for length, value in self.outputs[node]:
+                # leave out the padding so neighbouring keywords do not overlap on the space between them
+                matches.append((position - length + 2, position, value))
+        matches.sort(key=lambda match: (match[0] - match[1], match[0]))
+        selected = []
+        for start, end, value in matches:
+            if all(end <= selected_start or start >= selected_end for selected_start, selected_end, _ in selected):
+                selected.append((start, end, value))
+        selected.sort(key=lambda match: match[0])
+        return [value for _, _, value in selected]
@@ -1,18 +1,55 @@
 import aiohttp
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import glob
+import hashlib
 import importlib.util
 import json
 import logging
+import math
 import numpy as np
+from prometheus_client import generate_latest, start_http_server, CONTENT_TYPE_LATEST
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import threading
+import uuid
+from collections import OrderedDict
 from typing import Optional
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from document_index import DocumentSegment, DocumentIndex
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from index_store import SegmentStore
+from scheduler import UpdateScheduler
+from single_flight import SingleFlight, AsyncSingleFlight
+from token_counter import TokenCounter
+import metrics
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    global embedding_batcher, embedding_loop
+    # API workers set everything up here, `python main.py` already did before starting the API
+    set_up()
+    embedding_loop = asyncio.get_running_loop()
+    await get_embedding_client_session()
+    if config.get('embedding_batch_window', 0):
+        embedding_batcher = EmbeddingBatcher(get_embeddings_async, config['embedding_batch_window'], config.get('embedding_batch_size', 64), on_batch=metrics.embedding_batch_size.observe)
+    if worker_mode:
+        threading.Thread(target=reload_plugin_documents_thread, daemon=True).start()
+    yield
+    embedding_batcher = None
+    embedding_loop = None
+    if embedding_client_session:
+        await embedding_client_session.close()
+
+app = FastAPI(lifespan=lifespan)
 
 config_path = os.environ.get('CONFIG_PATH', 'config.json')
 
@@ -24,6 +61,75 @@ logging.basicConfig(level=config['log_level'], format='%(asctime)s - %(levelname
 logger = logging.getLogger(__name__)
 
 api_key = config['embedding_api_key']
+embedding_timeout = config.get('embedding_timeout', 10)
+
+# one connection pool for the embedding backend for the lifetime of the application
+# the synchronous session is used by plugin updates, the asynchronous one is created on startup and used by requests
+# the asynchronous session belongs to the event loop of the API, embedding_loop, and can't be used from any other
+embedding_session = requests.Session()
+embedding_session.headers.update({"Authorization": f"Bearer {api_key}"})
+embedding_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.get('embedding_pool_size', 10))
+embedding_session.mount('http://', embedding_adapter)
+embedding_session.mount('https://', embedding_adapter)
+embedding_client_session = None
+embedding_loop = None
+embedding_batcher = None
+embedding_single_flight = AsyncSingleFlight()
+# shared by all plugins and users, e.g. for identical HomeAssistant template renders
+plugin_single_flight = SingleFlight()
+# one circuit breaker per service we depend on, shared by every plugin using the same one
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+index_lock = threading.Lock()
+update_jobs = OrderedDict()
+update_jobs_lock = threading.RLock()
+plugin_statuses_lock = threading.Lock()
+token_counter = TokenCounter(config.get('tokenizer_path'), config.get('characters_per_token', 4))
+plugin_executor = ThreadPoolExecutor(max_workers=config.get('plugin_workers', 8), thread_name_prefix='plugin')
+# when the prompt being answered has to be ready, see get_remaining_time()
+prompt_deadline = contextvars.ContextVar('prompt_deadline', default=None)
+# the last rendering of every document, used in place of renderings that miss the deadline
+last_prompt_additions = OrderedDict()
+max_last_prompt_additions = 1000
+
+# opened by set_up()
+embedding_cache = None
+segment_store = None
+if config.get('index_snapshot_path', 'index_snapshot'):
+    segment_store = SegmentStore(config.get('index_snapshot_path', 'index_snapshot'), config['embedding_model'])
+# with more than one API worker, the process started by `python main.py` only updates plugins and stores their documents
+# and the API is served by uvicorn worker processes that memory-map those documents and never update plugins themselves
+api_workers = config.get('api_workers', 1)
+worker_mode = os.environ.get('PROMPT_GENERATOR_ROLE') == 'worker'
+if api_workers > 1 and not segment_store:
+    raise Exception("api_workers requires index_snapshot_path, which is where the workers get their documents from")
+if segment_store:
+    update_requests_directory = os.path.join(segment_store.directory, 'update_requests')
+    update_jobs_path = os.path.join(segment_store.directory, 'update_jobs.json')
+    plugin_statuses_path = os.path.join(segment_store.directory, 'plugin_statuses.json')
+    if api_workers > 1:
+        os.makedirs(update_requests_directory, exist_ok=True)
+query_embedding_cache = None
+if config.get('query_cache_size', 1024):
+    query_embedding_cache = QueryEmbeddingCache(config.get('query_cache_size', 1024), config.get('query_cache_ttl', 3600))
+
+def get_circuit_breaker(name, failure_exceptions=(Exception,)):
+    with circuit_breakers_lock:
+        if name not in circuit_breakers:
+            circuit_breakers[name] = CircuitBreaker(
+                name,
+                config.get('circuit_breaker_failures', 5),
+                config.get('circuit_breaker_reset_timeout', 5),
+                config.get('circuit_breaker_max_reset_timeout', 300),
+                on_state_change=circuit_breaker_state_changed,
+                failure_exceptions=failure_exceptions
+            )
+            metrics.circuit_breaker_state.labels(name).set(0)
+        return circuit_breakers[name]
+
+def circuit_breaker_state_changed(name, state):
+    metrics.circuit_breaker_state.labels(name).set({"closed": 0, "half_open": 1, "open": 2}[state])
 
 def compute_similarity(first, second):
     dot_product = np.dot(first, second)
@@ -35,22 +141,46 @@ def instantiate_plugins(directory, config):
     plugins = []
     utils = {
         "get_embedding": get_embedding,
+        "get_embeddings": get_embeddings,
         "get_embedding_async": get_embedding_async,
-        "compute_similarity": compute_similarity
+        "compute_similarity": compute_similarity,
+        "request_update": request_update,
+        "single_flight": plugin_single_flight.run,
+        "get_remaining_time": get_remaining_time,
+        "get_circuit_breaker": get_circuit_breaker
     }
     if 'plugins' in config:
         for module_name in config['plugins']:
-            spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, f'{module_name}.py'))
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            obj = getattr(module, 'Adapter')
+            plugin_config = config['plugins'].get(module_name, {})
+            # plugins with the exact same configuration are shared between users and only updated once
+            plugin_key = (module_name, hashlib.sha256(json.dumps(plugin_config, sort_keys=True).encode('utf-8')).hexdigest())
+            if plugin_key in plugin_instances:
+                plugins.append(plugin_instances[plugin_key])
+                continue
+            if module_name not in plugin_modules:
+                path = os.path.join(directory, f'{module_name}.py')
+                spec = importlib.util.spec_from_file_location(module_name, path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                plugin_modules[module_name] = module
+                # stored documents are only used by the version of the plugin that created them
+                # plugins can set Adapter.version, otherwise any change to the plugin is a new version
+                with open(path, 'rb') as f:
+                    plugin_versions[module_name] = str(getattr(module.Adapter, 'version', None) or hashlib.sha256(f.read()).hexdigest())
+            obj = getattr(plugin_modules[module_name], 'Adapter')
             if hasattr(obj, "__class__") and callable(obj):
-                plugin_config = config['plugins'].get(module_name, {})
                 plugin_class = obj(plugin_config, utils)
-                plugins.append({
+                plugin_instances[plugin_key] = {
                     "name": module_name,
-                    "class": plugin_class
-                })
+                    "key": plugin_key,
+                    "version": plugin_versions[module_name],
+                    "class": plugin_class,
+                    "config": plugin_config,
+                    "segment": None,
+                    "updated": None,
+                    "error": None
+                }
+                plugins.append(plugin_instances[plugin_key])
     return plugins
 
 def get_plugins(user_name):
@@ -66,83 +196,545 @@ def get_plugins(user_name):
             relevant_plugins.append(plugin)
     return relevant_plugins
 
-def update_plugins_thread():
+def update_plugin(plugin, timeout=None):
+    plugin_class = plugin["class"]
+    with metrics.plugin_update_seconds.labels(plugin['name']).time():
+        try:
+            if hasattr(plugin_class, 'update_async'):
+                asyncio.run(asyncio.wait_for(plugin_class.update_async(), timeout))
+            else:
+                plugin_class.update()
+        except Exception:
+            metrics.plugin_errors.labels(plugin['name'], 'update').inc()
+            raise
+
+def run_plugin_update(plugin, timeout=None):
+    # runs on the scheduler's worker threads, only the plugin that updated is re-indexed
+    # a failed update publishes nothing, so we keep serving the documents of the last one that succeeded
+    try:
+        update_plugin(plugin, timeout)
+        missing_embeddings = refresh_plugin_documents(plugin)
+    except Exception as e:
+        plugin['error'] = str(e) or type(e).__name__
+        logger.error(f"Error updating plugin {plugin['name']}: {plugin['error']}")
+        save_plugin_statuses()
+        raise
+    rebuild_document_indexes()
+    if missing_embeddings:
+        # the embedding API failed, count it as a failed update so it is retried soon and reported as stale
+        plugin['error'] = f"{missing_embeddings} documents could not be embedded"
+        logger.error(f"Error updating plugin {plugin['name']}: {plugin['error']}")
+        save_plugin_statuses()
+        raise Exception(plugin['error'])
+    plugin['error'] = None
+    save_plugin_statuses()
+
+def get_plugin_status_key(plugin_key):
+    return f"{plugin_key[0]}-{plugin_key[1]}"
+
+def save_plugin_statuses():
+    # lets API workers report plugins whose last update failed, they only see the documents of the last one that succeeded
+    if api_workers <= 1 or worker_mode:
+        return
+    with plugin_statuses_lock:
+        statuses = {get_plugin_status_key(plugin['key']): {"updated": plugin['updated'], "error": plugin['error']} for plugin in plugin_instances.values()}
+        with open(plugin_statuses_path + '.tmp', 'w') as f:
+            json.dump(statuses, f)
+        os.replace(plugin_statuses_path + '.tmp', plugin_statuses_path)
+
+def load_plugin_statuses():
+    # the statuses saved by the updater process, empty if it didn't save any yet
+    try:
+        with open(plugin_statuses_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def update_plugin_timed_out(plugin):
+    metrics.plugin_errors.labels(plugin['name'], 'update_timeout').inc()
+
+def get_update_settings(plugin):
+    # every plugin can override how often and how long it is updated in its own configuration
+    plugin_config = plugin['config']
+    return {
+        "interval": plugin_config.get('update_interval', config['update_interval']),
+        "jitter": plugin_config.get('update_jitter', config.get('update_jitter', 0)),
+        "timeout": plugin_config.get('update_timeout', config.get('update_timeout', 300)),
+        "retry_delay": plugin_config.get('update_retry_delay', config.get('update_retry_delay', 30))
+    }
+
+def request_update(plugin_class):
+    # plugins call this when their documents changed
+    # every request within update_debounce seconds of the first one is handled by a single update
+    # API workers leave this to the updater process, which notices the same changes
+    if worker_mode:
+        return
+    for plugin_key, plugin in list(plugin_instances.items()):
+        if plugin['class'] is plugin_class:
+            logger.debug(f"Documents of plugin {plugin['name']} changed, scheduling an update")
+            update_scheduler.schedule(plugin_key, config.get('update_debounce', 5))
+            return
+
+def start_update_job(plugin_keys, job_id=None):
+    # starts updating the given plugin instances in the background and returns the job tracking them
+    # triggering the same update again while it is still running returns the job that is already running
+    with update_jobs_lock:
+        for job in update_jobs.values():
+            if job['status'] == 'running' and job['plugin_keys'] == plugin_keys:
+                if job_id:
+                    # the API worker that queued this job already handed out its ID
+                    update_jobs[job_id] = job
+                    save_update_jobs()
+                return job
+        job = {
+            "id": job_id or uuid.uuid4().hex,
+            "plugin_keys": plugin_keys,
+            "status": "running",
+            "created": time.time(),
+            "finished": None,
+            "plugins": {}
+        }
+        update_jobs[job['id']] = job
+        # only keep the last 100 jobs around
+        while len(update_jobs) > 100:
+            update_jobs.popitem(last=False)
+        futures = update_scheduler.run_now(plugin_keys)
+        for plugin_key in futures:
+            job['plugins'][plugin_key] = {
+                "plugin": plugin_key[0],
+                "config_hash": plugin_key[1][:12],
+                "status": "running",
+                "duration": None,
+                "error": None
+            }
+        # only once every plugin is in the job, as callbacks of updates that already finished run right away
+        for plugin_key, future in futures.items():
+            future.add_done_callback(lambda future, plugin_key=plugin_key: finish_update_job_plugin(job, plugin_key, future.result()))
+        save_update_jobs()
+        return job
+
+def finish_update_job_plugin(job, plugin_key, result):
+    with update_jobs_lock:
+        job['plugins'][plugin_key].update({
+            "status": "failed" if result['error'] else "done",
+            "duration": result['duration'],
+            "error": result['error']
+        })
+        if all(plugin['status'] != 'running' for plugin in job['plugins'].values()):
+            job['status'] = 'failed' if any(plugin['error'] for plugin in job['plugins'].values()) else 'done'
+            job['finished'] = time.time()
+        save_update_jobs()
+
+def get_update_job_status(job_id, job):
+    with update_jobs_lock:
+        plugin_statuses = [dict(plugin) for plugin in job['plugins'].values()]
+        return {
+            "job_id": job_id,
+            "status": job['status'],
+            "created": job['created'],
+            "finished": job['finished'],
+            "completed": len([plugin for plugin in plugin_statuses if plugin['status'] != 'running']),
+            "total": len(plugin_statuses),
+            "plugins": plugin_statuses
+        }
+
+def queue_update_job(plugin_keys):
+    # API workers can't update plugins, so they leave the job for the updater process
+    job_id = uuid.uuid4().hex
+    path = os.path.join(update_requests_directory, f'{job_id}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump({"plugin_keys": plugin_keys}, f)
+    os.replace(path + '.tmp', path)
+    return job_id
+
+def update_requests_thread():
+    # runs in the updater process and starts the jobs queued by API workers
     while True:
-        time.sleep(config['update_interval'])
-        update_plugins()
+        for path in sorted(glob.glob(os.path.join(update_requests_directory, '*.json')), key=os.path.getmtime):
+            try:
+                with open(path) as f:
+                    plugin_keys = tuple(tuple(plugin_key) for plugin_key in json.load(f)['plugin_keys'])
+            except Exception as e:
+                logger.error(f"Error reading update request {path}: {str(e)}")
+                os.remove(path)
+                continue
+            # the request is only removed once the job is in update_jobs.json, so workers can always find one of them
+            start_update_job(plugin_keys, os.path.basename(path)[:-len('.json')])
+            os.remove(path)
+        time.sleep(config.get('index_reload_interval', 1))
 
-def update_plugins():
-    for plugin in plugins:
+def save_update_jobs():
+    # lets API workers report the status of the jobs they queued
+    if api_workers <= 1 or worker_mode:
+        return
+    statuses = {job_id: get_update_job_status(job_id, job) for job_id, job in update_jobs.items()}
+    with open(update_jobs_path + '.tmp', 'w') as f:
+        json.dump(statuses, f)
+    os.replace(update_jobs_path + '.tmp', update_jobs_path)
+
+def get_queued_update_job_status(job_id):
+    # the request is checked first: the updater removes it only after writing the job to update_jobs.json
+    queued = os.path.exists(os.path.join(update_requests_directory, f'{job_id}.json'))
+    try:
+        with open(update_jobs_path) as f:
+            status = json.load(f).get(job_id)
+    except FileNotFoundError:
+        status = None
+    if status is None and queued:
+        status = {"job_id": job_id, "status": "queued"}
+    return status
+
+def refresh_plugin_documents(plugin):
+    # returns the number of documents that could not be embedded, raises if the plugin failed to return its documents
+    try:
+        documents = get_plugin_documents(plugin)
+    except Exception as e:
+        metrics.plugin_errors.labels(plugin['name'], 'get_documents').inc()
+        raise Exception(f"Error getting documents: {str(e) or type(e).__name__}") from e
+    documents = list(documents or [])
+    segment = DocumentSegment(plugin['name'], documents, previous=plugin['segment'])
+    # the segment has its own normalized copy of every embedding, so the plugin doesn't need to keep its own
+    for document in documents:
+        document.pop('embedding', None)
+    # documents without an embedding mean the embedding API failed, the last documents are better than a partial set
+    # without any, the partial set is published, as the documents can still be found by their words
+    missing_embeddings = len(segment.documents) - len(segment.embedded)
+    if missing_embeddings and plugin['segment'] is not None and plugin['segment'].documents:
+        logger.warning(f"Keeping the documents of plugin {plugin['name']} from {time.ctime(plugin['updated'])}")
+        return missing_embeddings
+    plugin["segment"] = segment
+    plugin["updated"] = time.time()
+    if segment_store:
         try:
-            plugin["class"].update()
+            segment_store.save(plugin['key'], plugin['version'], plugin['segment'], plugin['updated'])
         except Exception as e:
-            logger.error(f"Error updating plugin {plugin['name']}: {str(e)}")
+            logger.error(f"Error storing documents of plugin {plugin['name']}: {str(e)}")
+    return missing_embeddings
 
-        if plugins_by_user:
-            for user_name in plugins_by_user:
-                for plugin in plugins_by_user[user_name]:
-                    try:
-                        plugin["class"].update()
-                    except Exception as e:
-                        logger.error(f"Error updating plugin {plugin['name']} for user {user_name}: {str(e)}")
+def load_plugin_documents():
+    # start with the documents stored by the last run, until the plugins updated
+    if not segment_store:
+        return
+    for plugin in plugin_instances.values():
+        if load_stored_documents(plugin):
+            logger.info(f"Loaded {len(plugin['segment'].documents)} stored documents of plugin {plugin['name']} from {time.ctime(plugin['updated'])}")
+    rebuild_document_indexes()
 
-def get_embedding(prompt):
-    headers = {"Authorization": f"Bearer {api_key}"}
-    data = {"model": config['embedding_model'], "input": prompt}
-    response = requests.post(f"{config['embedding_base_url']}/embeddings", headers=headers, json=data, timeout=10)
+def load_stored_documents(plugin):
+    # API workers map the embeddings instead of reading them, so all workers share one copy in the page cache
+    version = segment_store.get_version(plugin['key'])
+    stored = segment_store.load(plugin['key'], plugin['name'], plugin['version'], memory_map=worker_mode)
+    if not stored:
+        return False
+    plugin['segment'], plugin['updated'] = stored
+    plugin['store_version'] = version
+    return True
 
-    if response.status_code == 200:
-        embedding = response.json()["data"]
-        return embedding[0]['embedding']
-    else:
+def reload_plugin_documents_thread():
+    # API workers never update plugins, they pick up the documents stored by the updater process as soon as they change
+    while True:
+        time.sleep(config.get('index_reload_interval', 1))
+        changed = False
+        for plugin in plugin_instances.values():
+            version = segment_store.get_version(plugin['key'])
+            if version is not None and version != plugin.get('store_version') and load_stored_documents(plugin):
+                logger.debug(f"Reloaded the documents of plugin {plugin['name']}")
+                changed = True
+        if changed:
+            rebuild_document_indexes()
+
+def get_plugin_documents(plugin):
+    # get_documents() should only return what update() cached, so warn loudly if it is doing real work
+    start = time.monotonic()
+    documents = plugin["class"].get_documents()
+    duration = time.monotonic() - start
+    if duration > config.get('slow_get_documents_threshold', 0.05):
+        logger.warning(f"get_documents() of plugin {plugin['name']} took {duration:.3f} seconds, it should only return documents cached by update()")
+    return documents
+
+def rebuild_document_indexes():
+    with index_lock:
+        build_document_indexes()
+
+def build_document_indexes():
+    global document_snapshot
+    indexes = {
+        None: DocumentIndex([plugin['segment'] for plugin in plugins])
+    }
+    for user_name in plugins_by_user:
+        indexes[user_name] = DocumentIndex([plugin['segment'] for plugin in get_plugins(user_name)])
+    # publish everything as a new snapshot with a single assignment, so requests never see a partially built set of indexes
+    # and a request keeps using the snapshot it started with even if a new one is published in the meantime
+    document_snapshot = {
+        "version": document_snapshot['version'] + 1,
+        "created": time.time(),
+        "indexes": indexes
+    }
+    metrics.plugin_documents.clear()
+    for user_name, document_index in indexes.items():
+        for plugin_name in set(document_index.plugin_names):
+            metrics.plugin_documents.labels(plugin_name, user_name or '').set(document_index.plugin_names.count(plugin_name))
+    # every plugin instance is only counted once, no matter how many users share it
+    metrics.plugin_memory_bytes.clear()
+    for plugin in plugin_instances.values():
+        if plugin['segment'] is None:
+            continue
+        memory_usage = plugin['segment'].get_memory_usage()
+        for kind, size in memory_usage.items():
+            metrics.plugin_memory_bytes.labels(plugin['name'], plugin['key'][1][:12], kind).set(size)
+        logger.debug(f"Documents of plugin {plugin['name']} ({plugin['key'][1][:12]}) use {memory_usage['embeddings'] + memory_usage['mapped_embeddings']} bytes for embeddings and about {memory_usage['documents']} bytes for everything else")
+
+def get_cached_embedding(prompt):
+    if not embedding_cache:
+        return None
+    embedding = embedding_cache.get(config['embedding_model'], prompt)
+    metrics.embedding_cache_lookups.labels('disk', 'miss' if embedding is None else 'hit').inc()
+    return embedding
+
+class EmbeddingAPIError(Exception):
+    pass
+
+def check_embedding_response(status):
+    # server errors and rate limiting mean the embedding API is in trouble and count against its circuit breaker
+    if status >= 500 or status == 429:
+        raise EmbeddingAPIError(f"The embedding API responded with {status}")
+
+def post_embeddings(data):
+    # returns the embeddings the API responded with, or None if the request failed
+    try:
+        with embedding_circuit_breaker:
+            response = embedding_session.post(f"{config['embedding_base_url']}/embeddings", json=data, timeout=embedding_timeout)
+            check_embedding_response(response.status_code)
+    except CircuitOpenError as e:
+        metrics.embedding_requests.labels('circuit_open').inc()
+        logger.debug(str(e))
+        return None
+    except Exception as e:
+        metrics.embedding_requests.labels('error').inc()
+        logger.error(f"Error requesting embeddings: {str(e)}")
+        return None
+    metrics.embedding_requests.labels('success' if response.status_code == 200 else 'error').inc()
+    if response.status_code != 200:
         logger.error(f"Error: {response.status_code}")
-        return response
+        return None
+    return response.json()["data"]
+
+def get_embedding(prompt):
+    # returns None if the text could not be embedded
+    embedding = get_cached_embedding(prompt)
+    if embedding is not None:
+        return embedding
+    items = post_embeddings({"model": config['embedding_model'], "input": prompt})
+    if items is None:
+        return None
+    embedding = np.asarray(items[0]['embedding'], dtype=np.float32)
+    if embedding_cache:
+        embedding_cache.put(config['embedding_model'], prompt, embedding)
+    return embedding
+
+def get_embeddings(prompts):
+    # embeds many texts at once, only sending the ones that are not cached in batches of embedding_batch_size
+    # the result is in the same order as the input, with None for any text we failed to embed
+    embeddings = [None] * len(prompts)
+    missing_prompts = {}
+    for i, prompt in enumerate(prompts):
+        embeddings[i] = get_cached_embedding(prompt)
+        if embeddings[i] is None:
+            missing_prompts.setdefault(prompt, []).append(i)
+    missing_prompt_list = list(missing_prompts)
+    batch_size = config.get('embedding_batch_size', 64)
+    for batch_start in range(0, len(missing_prompt_list), batch_size):
+        batch = missing_prompt_list[batch_start:batch_start + batch_size]
+        items = post_embeddings({"model": config['embedding_model'], "input": batch})
+        if items is None:
+            continue
+        for position, item in enumerate(items):
+            prompt = batch[item.get('index', position)]
+            embedding = np.asarray(item['embedding'], dtype=np.float32)
+            if embedding_cache:
+                embedding_cache.put(config['embedding_model'], prompt, embedding)
+            for i in missing_prompts[prompt]:
+                embeddings[i] = embedding
+    return embeddings
+
+async def get_embedding_client_session():
+    global embedding_client_session
+    if embedding_client_session is None or embedding_client_session.closed:
+        connector = aiohttp.TCPConnector(limit=config.get('embedding_pool_size', 10), keepalive_timeout=config.get('embedding_keepalive', 30))
+        embedding_client_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=embedding_timeout),
+            headers={"Authorization": f"Bearer {api_key}"}
+        )
+    return embedding_client_session
+
+async def post_embeddings_async(data):
+    # returns the embeddings the API responded with, or None if the request failed
+    session = await get_embedding_client_session()
+    try:
+        with embedding_circuit_breaker:
+            async with session.post(f"{config['embedding_base_url']}/embeddings", json=data) as response:
+                check_embedding_response(response.status)
+                status = response.status
+                items = (await response.json())["data"] if status == 200 else None
+    except CircuitOpenError as e:
+        metrics.embedding_requests.labels('circuit_open').inc()
+        logger.debug(str(e))
+        return None
+    except Exception as e:
+        metrics.embedding_requests.labels('error').inc()
+        logger.error(f"Error requesting embeddings: {str(e) or type(e).__name__}")
+        return None
+    metrics.embedding_requests.labels('success' if status == 200 else 'error').inc()
+    if status != 200:
+        logger.error(f"Error: {status}")
+    return items
 
 async def get_embedding_async(prompt):
-    async with aiohttp.ClientSession() as session:
-        headers = {"Authorization": f"Bearer {api_key}"}
-        data = {"model": config['embedding_model'], "input": prompt}
-        async with session.post(f"{config['embedding_base_url']}/embeddings", headers=headers, json=data) as response:
-            if response.status == 200:
-                embedding = await response.json()
-                return embedding["data"][0]['embedding']
-            else:
-                logger.error(f"Error: {response.status}")
-                return response
+    # returns None if the text could not be embedded
+    loop = asyncio.get_running_loop()
+    if loop is not embedding_loop:
+        # e.g. update_async() of a plugin, which runs in its own event loop on a scheduler thread
+        return await loop.run_in_executor(None, get_embedding, prompt)
+    if query_embedding_cache:
+        embedding = query_embedding_cache.get(config['embedding_model'], prompt)
+        metrics.embedding_cache_lookups.labels('query', 'miss' if embedding is None else 'hit').inc()
+        if embedding is not None:
+            return embedding
+    # the disk cache is SQLite, which may have to wait for other processes, so it is read and written off the event loop
+    embedding = await loop.run_in_executor(None, get_cached_embedding, prompt)
+    if embedding is not None:
+        if query_embedding_cache:
+            query_embedding_cache.put(config['embedding_model'], prompt, embedding)
+        return embedding
+    # identical prompts that are embedded at the same time share one request, compared like the query cache does
+    key = query_embedding_cache.normalize(prompt) if query_embedding_cache else prompt
+    return await embedding_single_flight.run(key, lambda: fetch_embedding_async(prompt))
 
-def compute_similarity(first, second):
-    dot_product = np.dot(first, second)
-    magnitude_product = np.linalg.norm(first) * np.linalg.norm(second)
-    cosine_similarity = dot_product / magnitude_product
-    return cosine_similarity
+async def fetch_embedding_async(prompt):
+    if embedding_batcher:
+        # concurrent prompts are embedded together in one request
+        embedding = await embedding_batcher.embed(prompt)
+        if embedding is None:
+            return None
+    else:
+        items = await post_embeddings_async({"model": config['embedding_model'], "input": prompt})
+        if items is None:
+            return None
+        embedding = np.asarray(items[0]['embedding'], dtype=np.float32)
+    if embedding_cache:
+        # nobody needs to wait for this
+        asyncio.get_running_loop().run_in_executor(None, embedding_cache.put, config['embedding_model'], prompt, embedding)
+    if query_embedding_cache:
+        query_embedding_cache.put(config['embedding_model'], prompt, embedding)
+    return embedding
+
+async def get_embeddings_async(prompts):
+    # embeds all prompts with a single request, the result is in the same order with None for any prompt we failed to embed
+    embeddings = [None] * len(prompts)
+    items = await post_embeddings_async({"model": config['embedding_model'], "input": prompts})
+    for position, item in enumerate(items or []):
+        embeddings[item.get('index', position)] = np.asarray(item['embedding'], dtype=np.float32)
+    return embeddings
 
-def compute_plugin_similarities(prompt_embedding, plugins_to_use):
-    similarities = []
-    for plugin in plugins_to_use:
-        plugin_name = plugin['name']
-        plugin_class = plugin['class']
-        documents = plugin_class.get_documents()
-        for document in documents:
-            document_embedding = document['embedding']
-            similarity = compute_similarity(prompt_embedding, document_embedding)
-            similarities.append({
-                "document": document,
-                "similarity": similarity,
-                "plugin_name": plugin_name
-            })
-    return similarities
-
-
-async def process_prompt(user_prompt, plugins_to_use):
-    prompt_embedding = await get_embedding_async(user_prompt)
-    similarities = compute_plugin_similarities(prompt_embedding, plugins_to_use)
-    logger.debug(f'similarities: {similarities}')
-    for similarity in similarities:
-        logger.debug(f'cosine similarity between "{user_prompt}" and "{similarity["document"]["title"]}" is {similarity["similarity"]}')
-    similarities.sort(key=lambda x: x['similarity'], reverse=True)
-    selected_results = similarities[:config['number_of_results']]
+async def get_prompt_addition(plugin, document, user_prompt):
+    plugin_class = plugin['class']
+    with metrics.plugin_prompt_addition_seconds.labels(plugin['name']).time():
+        try:
+            if hasattr(plugin_class, 'get_llm_prompt_addition_async'):
+                return await plugin_class.get_llm_prompt_addition_async(document, user_prompt)
+            # legacy plugins are synchronous, run them in a thread so they don't block the event loop
+            # the thread gets a copy of our context, so the plugin can still see the deadline of the prompt
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(plugin_executor, context.run, plugin_class.get_llm_prompt_addition, document, user_prompt)
+        except Exception:
+            metrics.plugin_errors.labels(plugin['name'], 'get_llm_prompt_addition').inc()
+            raise
+
+def compute_plugin_similarities(user_prompt, prompt_embedding, document_index):
+    if document_index is None:
+        return []
+    number_of_results = config['number_of_results']
+    # without any embedded documents (e.g. the embedding API was down while indexing), words are all we can search by
+    if prompt_embedding is None or not document_index.matrices:
+        return document_index.search_lexical(user_prompt, number_of_results)
+    if config.get('retrieval_mode', 'vector') == 'hybrid':
+        return document_index.search_hybrid(user_prompt, prompt_embedding, number_of_results, config.get('rrf_k', 60))
+    return document_index.search(prompt_embedding, number_of_results)
+
+def get_remaining_time():
+    # seconds left until the prompt being answered has to be ready, None if there is no deadline
+    # plugins can use it to give up on slow calls that would miss the deadline anyway
+    deadline = prompt_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+def remember_prompt_addition(plugin, document, prompt_addition):
+    key = (plugin['key'], document['title'])
+    last_prompt_additions[key] = prompt_addition
+    last_prompt_additions.move_to_end(key)
+    while len(last_prompt_additions) > max_last_prompt_additions:
+        last_prompt_additions.popitem(last=False)
+
+async def get_prompt_embedding(user_prompt):
+    # returns None if the embedding backend is unavailable, so we can fall back to lexical search
+    try:
+        prompt_embedding = await get_embedding_async(user_prompt)
+    except Exception as e:
+        logger.error(f"Error getting the embedding of the prompt: {str(e)}")
+        return None
+    if not isinstance(prompt_embedding, np.ndarray):
+        return None
+    return prompt_embedding
+
+
+async def process_prompt(user_prompt, user_name):
+    # returns the prompt and a list of the parts of it that were degraded to make the deadline
+    deadline_seconds = config.get('prompt_deadline')
+    prompt_deadline.set(time.monotonic() + deadline_seconds if deadline_seconds else None)
+    degraded = []
+    plugins_to_use = get_plugins(user_name)
+    snapshot = document_snapshot
+    document_index = snapshot['indexes'].get(user_name)
+    logger.debug(f'using version {snapshot["version"]} of the documents')
+    selected_results = []
+    if config.get('keyword_routing_enabled', False) and document_index is not None:
+        # prompts that literally name an area or list don't need an embedding at all
+        with metrics.prompt_stage_seconds.labels('keyword_routing').time():
+            selected_results = document_index.route(user_prompt, config['number_of_results'])
+        if selected_results:
+            logger.debug(f'"{user_prompt}" matched the keywords of {len(selected_results)} documents, skipping the embedding')
+    if not selected_results:
+        prompt_embedding = None
+        if config.get('retrieval_mode', 'vector') != 'lexical':
+            with metrics.prompt_stage_seconds.labels('embedding').time():
+                # the embedding only gets part of the time, so there is some left to render the prompt additions
+                embedding_deadline = config.get('prompt_embedding_deadline', deadline_seconds / 2 if deadline_seconds else None)
+                try:
+                    # the embedding keeps going in the background for anyone else asking and ends up in the cache
+                    prompt_embedding = await asyncio.wait_for(get_prompt_embedding(user_prompt), embedding_deadline)
+                except asyncio.TimeoutError:
+                    logger.warning(f'Embedding "{user_prompt}" missed the deadline, falling back to lexical search')
+                    degraded.append({"stage": "embedding", "reason": "deadline", "fallback": "lexical"})
+                    metrics.prompt_degraded.labels('embedding', '').inc()
+                else:
+                    if prompt_embedding is None:
+                        logger.warning(f'Could not embed "{user_prompt}", falling back to lexical search')
+                        degraded.append({"stage": "embedding", "reason": "error", "fallback": "lexical"})
+                        metrics.prompt_degraded.labels('embedding', '').inc()
+        with metrics.prompt_stage_seconds.labels('similarity').time():
+            selected_results = compute_plugin_similarities(user_prompt, prompt_embedding, document_index)
+    minimum_similarity = config.get('minimum_similarity')
+    if minimum_similarity is not None:
+        selected_results = [result for result in selected_results if result['similarity'] is None or result['similarity'] >= minimum_similarity]
+    for similarity in selected_results:
+        logger.debug(f'cosine similarity between "{user_prompt}" and "{similarity["document"]["title"]}" is {similarity["similarity"]} (score {similarity["score"]})')
     llm_prompt = ""
     examples = []
+    # render all prompt additions concurrently, then assemble them in order of similarity
+    selected_documents = []
     for result in selected_results:
         document_title = result['document']['title']
         similarity = result['similarity']
@@ -150,66 +742,238 @@ async def process_prompt(user_prompt, plugins_to_use):
         logger.debug(f'selected "{document_title}" with a cosine similarity of {similarity}')
         for plugin in plugins_to_use:
             if plugin['name'] == plugin_name:
-                plugin_class = plugin['class']
-                prompt_addition = plugin_class.get_llm_prompt_addition(result['document'], user_prompt)
-                logger.debug(f'prompt_addition: {prompt_addition}')
-                llm_prompt = llm_prompt + prompt_addition['prompt'].strip()
-                llm_prompt = llm_prompt + '\n\n\n'
-                for example in prompt_addition['examples']:
-                    examples.append(example)
+                selected_documents.append((plugin, result['document']))
+    with metrics.prompt_stage_seconds.labels('prompt_additions').time():
+        remaining_time = get_remaining_time()
+        outcomes = await asyncio.gather(
+            *(asyncio.wait_for(get_prompt_addition(plugin, document, user_prompt), remaining_time) for plugin, document in selected_documents),
+            return_exceptions=True
+        )
+    # renderings that missed the deadline or failed (e.g. because a service is down) are replaced with
+    # the last rendering of the same document, or dropped
+    prompt_additions = []
+    for (plugin, document), outcome in zip(selected_documents, outcomes):
+        if isinstance(outcome, Exception):
+            prompt_addition = last_prompt_additions.get((plugin['key'], document['title']))
+            fallback = "dropped" if prompt_addition is None else "cached"
+            if isinstance(outcome, asyncio.TimeoutError):
+                reason = "deadline"
+                logger.warning(f'The prompt addition of "{document["title"]}" from plugin {plugin["name"]} missed the deadline, {fallback}')
+            else:
+                reason = "error"
+                logger.error(f'Error getting the prompt addition of "{document["title"]}" from plugin {plugin["name"]}, {fallback}: {str(outcome) or type(outcome).__name__}')
+            degraded.append({"stage": "prompt_addition", "plugin": plugin['name'], "title": document['title'], "reason": reason, "fallback": fallback})
+            metrics.prompt_degraded.labels('prompt_addition', plugin['name']).inc()
+            if prompt_addition is not None:
+                prompt_additions.append(prompt_addition)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            remember_prompt_addition(plugin, document, outcome)
+            prompt_additions.append(outcome)
+    assembly_start = time.perf_counter()
+    # with a token budget, sections are packed greedily in order of score and whatever doesn't fit is dropped
+    # the most relevant section is truncated line by line rather than dropped
+    token_budget = config.get('prompt_token_budget')
+    remaining_tokens = token_budget if token_budget else math.inf
+    for prompt_addition in prompt_additions:
+        logger.debug(f'prompt_addition: {prompt_addition}')
+        section = prompt_addition['prompt'].strip() + '\n\n\n'
+        section_tokens = token_counter.count(section) if token_budget else 0
+        if section_tokens > remaining_tokens:
+            if llm_prompt:
+                logger.debug(f'dropped a section of {section_tokens} tokens as only {remaining_tokens} tokens are left')
+                continue
+            section = token_counter.truncate(section, remaining_tokens)
+            if not section:
+                # not even its first line fits, so neither the section nor its examples are used
+                logger.debug(f'dropped a section of {section_tokens} tokens as not even its first line fits in {remaining_tokens} tokens')
+                continue
+            section = section + '\n\n\n'
+            section_tokens = token_counter.count(section)
+        llm_prompt = llm_prompt + section
+        remaining_tokens -= section_tokens
+        for example in prompt_addition['examples']:
+            examples.append(example)
     if 'include_examples' in config and config['include_examples'] == True:
         if examples:
-            llm_prompt = llm_prompt.strip() + '\n\n\nFind examples below. Reword the answers to fit your personality. Prompts are given as Q: and the example answers are given as A:\n\n'
+            examples_header = '\n\n\nFind examples below. Reword the answers to fit your personality. Prompts are given as Q: and the example answers are given as A:\n\n'
+            examples_text = ''
+            header_tokens = token_counter.count(examples_header) if token_budget else 0
             for example in examples:
                 question = example[0]
                 answer = example[1]
-                llm_prompt = f'{llm_prompt}Q:{question}\nA:{answer}\n\n'
+                example_text = f'Q:{question}\nA:{answer}\n\n'
+                example_tokens = token_counter.count(example_text) if token_budget else 0
+                # the header only costs anything if there is at least one example under it
+                if not examples_text:
+                    example_tokens += header_tokens
+                if example_tokens > remaining_tokens:
+                    continue
+                examples_text = examples_text + example_text
+                remaining_tokens -= example_tokens
+            if examples_text:
+                llm_prompt = llm_prompt.strip() + examples_header + examples_text
     llm_prompt = llm_prompt.strip()
-    return llm_prompt
+    metrics.prompt_stage_seconds.labels('assembly').observe(time.perf_counter() - assembly_start)
+    return llm_prompt, degraded
+
+def authenticate(credentials):
+    # returns the name of the user the token belongs to, or None if authentication is disabled
+    if not users_config:
+        return None
+    for user, user_data in users_config.items():
+        if credentials.scheme.lower() == 'bearer' and credentials.credentials == user_data['token']:
+            return user
+    raise HTTPException(status_code=401, detail='Unauthorized')
 
 @app.post("/prompt")
 async def process_prompt_endpoint(
     user_prompt: str = Body(..., embed=True),
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer()) if users_config else None,
 ):
-    user_name = None
-    if users_config:
-        for user, user_data in users_config.items():
-            if credentials.scheme.lower() == 'bearer' and credentials.credentials == user_data['token']:
-                user_name = user
-                break
-        else:
-            raise HTTPException(status_code=401, detail='Unauthorized')
-    plugins_to_use = get_plugins(user_name)
-    llm_prompt = await process_prompt(user_prompt, plugins_to_use)
-    return JSONResponse(content={"prompt": llm_prompt}, media_type="application/json")
+    user_name = authenticate(credentials)
+    llm_prompt, degraded = await process_prompt(user_prompt, user_name)
+    return JSONResponse(content={"prompt": llm_prompt, "degraded": degraded}, media_type="application/json")
 
 @app.post("/update")
 async def update_plugins_endpoint(
+    plugin: Optional[str] = Body(None, embed=True),
+    user: Optional[str] = Body(None, embed=True),
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer()) if users_config else None,
 ):
-    if users_config:
-        for user, user_data in users_config.items():
-            if credentials.scheme.lower() == 'bearer' and credentials.credentials == user_data['token']:
-                break
-        else:
-            raise HTTPException(status_code=401, detail='Unauthorized')
-    update_plugins()
-    return JSONResponse(content={"success": True}, media_type="application/json")
+    authenticate(credentials)
+    # the update runs in the background, poll /update/{job_id} to see how it went
+    if user is not None and user not in plugins_by_user:
+        raise HTTPException(status_code=404, detail=f'Unknown user {user}')
+    plugin_keys = tuple(candidate['key'] for candidate in (get_plugins(user) if user else plugin_instances.values()) if plugin is None or candidate['name'] == plugin)
+    if not plugin_keys:
+        raise HTTPException(status_code=404, detail=f'Unknown plugin {plugin}')
+    if worker_mode:
+        return JSONResponse(content={"success": True, "job_id": queue_update_job(plugin_keys)}, media_type="application/json")
+    job = start_update_job(plugin_keys)
+    return JSONResponse(content={"success": True, "job_id": job['id']}, media_type="application/json")
+
+@app.get("/update/{job_id}")
+async def update_status_endpoint(
+    job_id: str,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer()) if users_config else None,
+):
+    authenticate(credentials)
+    if worker_mode:
+        status = get_queued_update_job_status(job_id)
+    else:
+        job = update_jobs.get(job_id)
+        status = None if job is None else get_update_job_status(job_id, job)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f'Unknown job {job_id}')
+    return JSONResponse(content=status, media_type="application/json")
 
+@app.get("/metrics")
+async def metrics_endpoint(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer()) if users_config else None,
+):
+    authenticate(credentials)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready")
+async def ready_endpoint(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer()) if users_config else None,
+):
+    authenticate(credentials)
+    # ready as soon as every plugin has documents, whether they were loaded from disk or just updated
+    # documents are stale when their last update failed or they are older than an update should ever take,
+    # they are still served as they are better than nothing
+    now = time.time()
+    # API workers don't update plugins, the updater process tells them which updates failed
+    saved_statuses = load_plugin_statuses() if worker_mode else {}
+    plugin_statuses = []
+    for plugin in plugin_instances.values():
+        error = saved_statuses.get(get_plugin_status_key(plugin['key']), {}).get('error') if worker_mode else plugin['error']
+        age = None if plugin['updated'] is None else now - plugin['updated']
+        update_settings = get_update_settings(plugin)
+        maximum_age = update_settings['interval'] + update_settings['jitter'] + (update_settings['timeout'] or 0)
+        plugin_statuses.append({
+            "plugin": plugin['name'],
+            "config_hash": plugin['key'][1][:12],
+            "updated": plugin['updated'],
+            "age": age,
+            "stale": age is not None and (error is not None or age > maximum_age),
+            "error": error
+        })
+    ready = all(plugin['age'] is not None for plugin in plugin_statuses)
+    with circuit_breakers_lock:
+        upstream_circuit_breakers = list(circuit_breakers.values())
+    snapshot = document_snapshot
+    return JSONResponse(content={
+        "ready": ready,
+        "version": snapshot['version'],
+        "index_age": max([plugin['age'] for plugin in plugin_statuses if plugin['age'] is not None], default=None),
+        "plugins": plugin_statuses,
+        "upstreams": [circuit_breaker.get_status() for circuit_breaker in upstream_circuit_breakers]
+    }, status_code=200 if ready else 503, media_type="application/json")
+
+# only errors talking to the embedding API count against it, not bugs on our side
+embedding_circuit_breaker = get_circuit_breaker(
+    f"embedding API ({config['embedding_base_url']})",
+    (requests.RequestException, aiohttp.ClientError, asyncio.TimeoutError, EmbeddingAPIError)
+)
 plugins_directory = "plugins"
-plugins = instantiate_plugins(plugins_directory, config)
+plugin_modules = {}
+plugin_versions = {}
+plugin_instances = {}
+plugins = []
 plugins_by_user = {}
-if users_config:
-    for user_name in users_config:
-        user_data = users_config[user_name]
-        plugins_by_user[user_name] = instantiate_plugins(plugins_directory, user_data)
+document_snapshot = {"version": 0, "created": None, "indexes": {}}
+update_scheduler = None
+set_up_lock = threading.Lock()
+
+def set_up():
+    # opens the embedding cache, instantiates the plugins and loads their stored documents, once per process
+    # this is not done on import, as uvicorn workers import this module twice (once as __mp_main__)
+    global embedding_cache, plugins, update_scheduler
+    with set_up_lock:
+        if update_scheduler is not None:
+            return
+        if config.get('embedding_cache_path', 'embedding_cache.sqlite3'):
+            embedding_cache = EmbeddingCache(config.get('embedding_cache_path', 'embedding_cache.sqlite3'), config.get('embedding_cache_max_entries', 100000))
+        plugins = instantiate_plugins(plugins_directory, config)
+        if users_config:
+            for user_name in users_config:
+                user_data = users_config[user_name]
+                plugins_by_user[user_name] = instantiate_plugins(plugins_directory, user_data)
+        for plugin in plugin_instances.values():
+            start_plugin(plugin)
+        scheduler = UpdateScheduler(run_plugin_update, config.get('update_workers', 4), on_timeout=update_plugin_timed_out)
+        for plugin_key, plugin in plugin_instances.items():
+            scheduler.add(plugin_key, plugin['name'], plugin, **get_update_settings(plugin))
+        update_scheduler = scheduler
+        load_plugin_documents()
+
+def start_plugin(plugin):
+    # plugins can start whatever they need to answer requests (like the HomeAssistant websocket) in start()
+    # it runs in every process serving requests, API workers included, which never call update()
+    if hasattr(plugin['class'], 'start'):
+        try:
+            plugin['class'].start()
+        except Exception as e:
+            metrics.plugin_errors.labels(plugin['name'], 'start').inc()
+            logger.error(f"Error starting plugin {plugin['name']}: {str(e)}")
 
 if __name__ == "__main__":
-    update_plugins()
-    update_thread = threading.Thread(target=update_plugins_thread)
-    update_thread.daemon = True
-    update_thread.start()
+    set_up()
+    # requests are answered with the stored documents while the plugins update in the background
+    update_scheduler.run_now()
+    update_scheduler.start()
     logger.info("Update started, starting API")
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if api_workers > 1:
+        threading.Thread(target=update_requests_thread, daemon=True).start()
+        # this process serves no API, so the metrics of updates can only be scraped from here
+        if config.get('updater_metrics_port'):
+            start_http_server(config['updater_metrics_port'])
+        # the workers import this module again, this tells them not to update plugins
+        os.environ['PROMPT_GENERATOR_ROLE'] = 'worker'
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=api_workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
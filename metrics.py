@@ -0,0 +1,64 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# voice assistants need answers in well under a second, so most buckets are there
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+update_buckets = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+prompt_stage_seconds = Histogram(
+    'prompt_generator_prompt_stage_seconds',
+    'Time spent in each stage of a /prompt request',
+    ['stage'],
+    buckets=latency_buckets
+)
+plugin_prompt_addition_seconds = Histogram(
+    'prompt_generator_plugin_prompt_addition_seconds',
+    'Time spent rendering the prompt addition of a selected document, per plugin',
+    ['plugin'],
+    buckets=latency_buckets
+)
+plugin_update_seconds = Histogram(
+    'prompt_generator_plugin_update_seconds',
+    'Time spent updating a plugin',
+    ['plugin'],
+    buckets=update_buckets
+)
+plugin_documents = Gauge(
+    'prompt_generator_plugin_documents',
+    'Number of indexed documents per plugin and user',
+    ['plugin', 'user']
+)
+plugin_memory_bytes = Gauge(
+    'prompt_generator_plugin_memory_bytes',
+    'Bytes used by the indexed documents of a plugin instance, for embeddings, memory-mapped embeddings (shared by all processes) and (estimated) for the documents themselves',
+    ['plugin', 'instance', 'kind']
+)
+prompt_degraded = Counter(
+    'prompt_generator_prompt_degraded_total',
+    'Parts of /prompt requests that missed the deadline or failed, the plugin is empty for the embedding',
+    ['stage', 'plugin']
+)
+plugin_errors = Counter(
+    'prompt_generator_plugin_errors_total',
+    'Errors raised by plugins',
+    ['plugin', 'operation']
+)
+embedding_requests = Counter(
+    'prompt_generator_embedding_requests_total',
+    'Requests sent to the embedding API',
+    ['result']
+)
+circuit_breaker_state = Gauge(
+    'prompt_generator_circuit_breaker_state',
+    'State of the circuit breaker of every service we depend on: 0 closed, 1 half open (probing), 2 open (failing fast)',
+    ['upstream']
+)
+embedding_cache_lookups = Counter(
+    'prompt_generator_embedding_cache_lookups_total',
+    'Embedding cache lookups',
+    ['cache', 'result']
+)
+embedding_batch_size = Histogram(
+    'prompt_generator_embedding_batch_size',
+    'Number of prompts embedded together by the micro-batcher',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
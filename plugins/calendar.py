@@ -1,31 +1,55 @@
+import contextlib
 import icalendar
+import logging
 import requests
 import datetime
 import random
+import threading
+import time
 import tzlocal
 import dateutil.rrule
 
+logger = logging.getLogger(__name__)
+
 class Adapter:
     def __init__(self, config, utils):
         self.utils = utils
         self.calendar_configuration = config['calendars']
         self.example_count = config.get('example_count', 1)
         self.local_tz = tzlocal.get_localzone()
+        self.change_poll_interval = config.get('change_poll_interval', 0)
         self.calendars = {}
-        self.calendar_events = []
+        self.calendar_versions = {}
         self.documents = []
+        self.poll_thread = None
+
+    def get_circuit_breaker(self, caldav_url):
+        # while a calendar server is down, calls to it fail right away instead of waiting for their timeout
+        if 'get_circuit_breaker' not in self.utils:
+            return contextlib.nullcontext()
+        return self.utils['get_circuit_breaker'](f"calendar ({caldav_url})")
+
+    def get_calendar_version(self, response):
+        return (response.headers.get('ETag'), response.headers.get('Last-Modified'))
 
     def update(self):
+        if self.change_poll_interval and self.poll_thread is None:
+            self.poll_thread = threading.Thread(target=self.poll_changes, daemon=True)
+            self.poll_thread.start()
+        # a calendar that can't be downloaded keeps the version we parsed last time, unless none of them can be
+        failed_calendars = []
         for calendar in self.calendar_configuration:
             caldav_url = calendar.get('url')
-            username = calendar.get('username')
-            password = calendar.get('password')
-            session = requests.Session()
-            session.auth = (username, password)
-            response = session.get(caldav_url, timeout=10)
-            calendar_object = icalendar.Calendar.from_ical(response.text)
-            self.calendars[caldav_url] = calendar_object
-        self.calendar_events = []
+            try:
+                self.update_calendar(calendar)
+            except Exception as e:
+                logger.error(f"Error updating calendar {caldav_url}: {str(e)}")
+                failed_calendars.append(caldav_url)
+        if failed_calendars and len(failed_calendars) == len(self.calendar_configuration):
+            raise Exception("Could not update any calendar")
+        # everything is built in local variables and published at once by replacing self.documents
+        # requests only read the events stored in the document they were given, never a list that is being rebuilt
+        calendar_events = []
         title = "All calendar events (meetings, appointments, tasks) for the next week:"
         for calendar in self.calendars.keys():
             calendar_obj = self.calendars[calendar]
@@ -47,7 +71,7 @@ class Adapter:
                     if hasattr(event_end, 'astimezone'):
                         event_end = event_end.astimezone(self.local_tz)
                     if start <= event_start < end:
-                        self.calendar_events.append(component)
+                        calendar_events.append(component)
                     # handle recurring events
                     rrule_attr = component.get("RRULE")
                     if rrule_attr:
@@ -121,10 +145,11 @@ class Adapter:
                             recurring_event.add("DTEND", recurring_event_start + (event_end - event_start))
                             recurring_event.add("SUMMARY", component.get("SUMMARY"))
                             recurring_event.add("TITLE", component.get("TITLE"))
-                            self.calendar_events.append(recurring_event)
+                            calendar_events.append(recurring_event)
 
-        if self.calendar_events:
-            for event in self.calendar_events:
+        events = []
+        if calendar_events:
+            for event in calendar_events:
                 event_start = event.get('DTSTART').dt
                 if isinstance(event_start, datetime.date) and not isinstance(event_start, datetime.datetime):
                     event_start = datetime.datetime.combine(event_start, datetime.time(0, tzinfo=self.local_tz))
@@ -135,9 +160,9 @@ class Adapter:
                     event_end = datetime.datetime.combine(event_end, datetime.time(0, tzinfo=self.local_tz))
                     event_end = event_end + datetime.timedelta(days=1)
                     event['DTEND'].dt = event_end
-            self.calendar_events.sort(key=lambda x: x.get('DTSTART').dt)
+            calendar_events.sort(key=lambda x: x.get('DTSTART').dt)
             llm_prompt = f"{title}\n"
-            for event in self.calendar_events:
+            for event in calendar_events:
                 event_start = event.get("DTSTART").dt
                 if isinstance(event_start, datetime.date) and not isinstance(event_start, datetime.datetime):
                     event_start = datetime.datetime.combine(event_start, datetime.time(0, tzinfo=self.local_tz))
@@ -156,51 +181,86 @@ class Adapter:
                 event_summary = event.get('SUMMARY')
                 if not event_summary:
                     event_summary = event.get('TITLE')
+                events.append((event_summary, event_start, event_end))
                 llm_prompt = llm_prompt + '\n- ' + (f"{event_summary} between {event_start_formatted} and {event_end_formatted} on {event_day_of_week}, {event_start_date_formatted}")
 
         else:
             llm_prompt = f"{title}\n\nThere are no calendar events in the next week."
 
-        self.llm_prompt = llm_prompt
         self.documents = [
             {
-                "title": self.llm_prompt,
-                "embedding": self.utils['get_embedding'](self.llm_prompt)
+                "title": llm_prompt,
+                "embedding": self.utils['get_embedding'](llm_prompt),
+                "keywords": ["calendar", "schedule"],
+                "events": events
             }
         ]
 
+    def update_calendar(self, calendar):
+        caldav_url = calendar.get('url')
+        username = calendar.get('username')
+        password = calendar.get('password')
+        session = requests.Session()
+        session.auth = (username, password)
+        headers = {}
+        if caldav_url in self.calendars:
+            etag, last_modified = self.calendar_versions.get(caldav_url, (None, None))
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        with self.get_circuit_breaker(caldav_url):
+            response = session.get(caldav_url, headers=headers, timeout=10)
+            if response.status_code >= 500:
+                raise Exception(f"The calendar server responded with {response.status_code}")
+        if response.status_code == 304:
+            # the calendar did not change, keep the one we parsed last time
+            return
+        calendar_object = icalendar.Calendar.from_ical(response.text)
+        self.calendars[caldav_url] = calendar_object
+        self.calendar_versions[caldav_url] = self.get_calendar_version(response)
+
+    def poll_changes(self):
+        # ask the servers whether the calendars changed (ETag or Last-Modified) without downloading them
+        # and ask for an update as soon as one did
+        while True:
+            time.sleep(self.change_poll_interval)
+            for calendar in self.calendar_configuration:
+                caldav_url = calendar.get('url')
+                try:
+                    with self.get_circuit_breaker(caldav_url):
+                        response = requests.head(caldav_url, auth=(calendar.get('username'), calendar.get('password')), timeout=10)
+                except Exception as e:
+                    logger.error(f"Error checking calendar {caldav_url} for changes: {str(e)}")
+                    continue
+                version = self.get_calendar_version(response)
+                if version != (None, None) and version != self.calendar_versions.get(caldav_url):
+                    self.utils['request_update'](self)
+                    break
+
     def get_event_key(self, event):
-        event_start = event.get("DTSTART").dt
+        event_start = event[1]
         now = datetime.datetime.now(event_start.tzinfo)
-        if isinstance(event_start, datetime.date) and not isinstance(event_start, datetime.datetime):
-            event_start = datetime.datetime.combine(event_start, datetime.time(0))
         return abs((event_start - now).total_seconds())
 
     def get_documents(self):
         return self.documents
 
-    def get_llm_prompt_addition(self, selected_categories, user_prompt):
+    def get_llm_prompt_addition(self, document, user_prompt):
         examples = []
-        if self.calendar_events:
+        events = document['events']
+        if events:
             now = datetime.datetime.now(self.local_tz)
             # we can only reliably create three examples, so let's cap there for now
             # also, why would you want more than 3 calendar examples anyway?
             number_of_samples = min(self.example_count, 3)
 
             days_with_events = {}
-            for event in self.calendar_events:
-                event_start = event.get("DTSTART").dt
-                if isinstance(event_start, datetime.date) and not isinstance(event_start, datetime.datetime):
-                    event_start = datetime.datetime.combine(event_start, datetime.time(0, tzinfo=self.local_tz))
-                if hasattr(event_start, 'astimezone'):
-                    event_start = event_start.astimezone(self.local_tz)
+            for event_summary, event_start, _ in events:
                 event_day_of_week = event_start.strftime("%A")
                 event_start_formatted = event_start.strftime('%I:%M %p')
                 if event_day_of_week not in days_with_events:
                     days_with_events[event_day_of_week] = []
-                event_summary = event.get('SUMMARY')
-                if not event_summary:
-                    event_summary = event.get('TITLE')
                 days_with_events[event_day_of_week].append((event_summary, event_start_formatted))
 
             days_without_events = []
@@ -210,13 +270,7 @@ class Adapter:
                 if day not in days_with_events:
                     days_without_events.append(day)
 
-            closest_event = min(self.calendar_events, key=self.get_event_key)
-
-            closest_event_start = closest_event.get("DTSTART").dt
-            if isinstance(closest_event_start, datetime.date) and not isinstance(closest_event_start, datetime.datetime):
-                closest_event_start = datetime.datetime.combine(closest_event_start, datetime.time(0, tzinfo=self.local_tz))
-            if hasattr(closest_event_start, 'astimezone'):
-                closest_event_start = closest_event_start.astimezone(self.local_tz)
+            closest_event_summary, closest_event_start, _ = min(events, key=self.get_event_key)
 
             closest_event_start_formatted = closest_event_start.strftime('%I:%M %p')
             closest_event_day_of_week = closest_event_start.strftime("%A")
@@ -241,9 +295,6 @@ class Adapter:
                         )
                     )
 
-            closest_event_summary = closest_event.get('SUMMARY')
-            if not closest_event_summary:
-                closest_event_summary = closest_event.get('TITLE')
             examples.append(
                 (
                     "What's the first thing in my calendar?",
@@ -261,6 +312,6 @@ class Adapter:
             examples = random.sample(examples, number_of_samples)
 
         return {
-            "prompt": self.llm_prompt,
+            "prompt": document['title'],
             "examples": examples
         }
@@ -1,6 +1,211 @@
+import aiohttp
+import asyncio
+import contextlib
+import logging
 import requests
 import json
 import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+def check_response(response):
+    # only errors of HomeAssistant itself count against its circuit breaker, not e.g. a broken template
+    if response.status_code >= 500:
+        raise Exception(f"HomeAssistant responded with {response.status_code}")
+
+class StateMirror:
+    # an in-process copy of Home Assistant's states, area/floor/device/entity registries
+    # kept up to date over the websocket API so prompts can be rendered without asking Home Assistant
+    def __init__(self, base_url, access_token, on_change=None, reconnect_interval=10):
+        self.websocket_url = base_url.replace('http', 'ws', 1).rstrip('/') + '/api/websocket'
+        self.access_token = access_token
+        # called whenever something that affects the documents changes
+        self.on_change = on_change
+        self.reconnect_interval = reconnect_interval
+        self.ready = threading.Event()
+        self.thread = None
+        self.websocket = None
+        self.message_id = 0
+        self.pending_results = {}
+        self.registry_refresh_task = None
+        self.registry_refresh_requested = False
+        self.states = {}
+        self.areas = {}
+        self.floors = {}
+        self.devices = {}
+        self.entities = {}
+        self.area_devices = {}
+        self.device_entities = {}
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+            self.thread.start()
+
+    async def run(self):
+        while True:
+            try:
+                await self.connect()
+            except Exception as e:
+                logger.error(f"Home Assistant websocket connection to {self.websocket_url} failed: {str(e)}")
+            self.ready.clear()
+            await asyncio.sleep(self.reconnect_interval)
+
+    async def connect(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.websocket_url, heartbeat=30) as websocket:
+                message = await websocket.receive_json()
+                if message['type'] == 'auth_required':
+                    await websocket.send_json({"type": "auth", "access_token": self.access_token})
+                    message = await websocket.receive_json()
+                if message['type'] != 'auth_ok':
+                    raise Exception(f"authentication failed: {message.get('message')}")
+                self.websocket = websocket
+                self.pending_results = {}
+                reader = asyncio.create_task(self.read_messages())
+                try:
+                    # subscribe before fetching so we do not miss anything that changes in between
+                    await self.send_command({"type": "subscribe_events", "event_type": "state_changed"})
+                    for event_type in ["area_registry_updated", "floor_registry_updated", "device_registry_updated", "entity_registry_updated", "shopping_list_updated"]:
+                        await self.send_command({"type": "subscribe_events", "event_type": event_type})
+                    await self.refresh_registries()
+                    states = await self.send_command({"type": "get_states"})
+                    self.states = {state['entity_id']: state for state in states}
+                    self.ready.set()
+                    logger.info(f"Mirroring {len(self.states)} Home Assistant states from {self.websocket_url}")
+                    await reader
+                finally:
+                    reader.cancel()
+                    if self.registry_refresh_task:
+                        self.registry_refresh_task.cancel()
+                    self.websocket = None
+
+    async def send_command(self, command):
+        self.message_id += 1
+        command = dict(command, id=self.message_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending_results[self.message_id] = future
+        await self.websocket.send_json(command)
+        return await future
+
+    async def read_messages(self):
+        async for message in self.websocket:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            message = json.loads(message.data)
+            if message['type'] == 'result':
+                future = self.pending_results.pop(message['id'], None)
+                if future is None or future.done():
+                    continue
+                if message['success']:
+                    future.set_result(message['result'])
+                else:
+                    future.set_exception(Exception(message['error'].get('message')))
+            elif message['type'] == 'event':
+                self.handle_event(message['event'])
+        for future in self.pending_results.values():
+            if not future.done():
+                future.set_exception(Exception("websocket closed"))
+        raise Exception("websocket closed")
+
+    def handle_event(self, event):
+        if event['event_type'] == 'state_changed':
+            entity_id = event['data']['entity_id']
+            new_state = event['data'].get('new_state')
+            was_available = self.is_available(entity_id)
+            if new_state is None:
+                self.states.pop(entity_id, None)
+            else:
+                self.states[entity_id] = new_state
+            # unavailable entities are left out of the area documents
+            if was_available != self.is_available(entity_id):
+                self.notify_change()
+        elif event['event_type'].endswith('_registry_updated'):
+            # registry events come in bursts (e.g. while Home Assistant starts), they are handled by a single refresh
+            # that runs once more if anything changed while it was running
+            self.registry_refresh_requested = True
+            if self.registry_refresh_task is None or self.registry_refresh_task.done():
+                # keep a reference to the task, the event loop only keeps a weak one
+                self.registry_refresh_task = asyncio.create_task(self.refresh_registries_and_notify())
+        elif event['event_type'] == 'shopping_list_updated':
+            self.notify_change()
+
+    def notify_change(self):
+        if self.on_change and self.ready.is_set():
+            self.on_change()
+
+    async def refresh_registries_and_notify(self):
+        while self.registry_refresh_requested:
+            self.registry_refresh_requested = False
+            try:
+                await self.refresh_registries()
+            except Exception as e:
+                logger.error(f"Error refreshing Home Assistant registries: {str(e)}")
+                return
+        self.notify_change()
+
+    async def send_optional_command(self, command):
+        # floors only exist on newer Home Assistant versions
+        try:
+            return await self.send_command(command)
+        except Exception as e:
+            logger.debug(f"Home Assistant command {command['type']} failed: {str(e)}")
+            return []
+
+    async def refresh_registries(self):
+        areas = await self.send_command({"type": "config/area_registry/list"})
+        floors = await self.send_optional_command({"type": "config/floor_registry/list"})
+        devices = await self.send_command({"type": "config/device_registry/list"})
+        entities = await self.send_command({"type": "config/entity_registry/list"})
+        area_devices = {}
+        for device in devices:
+            area_devices.setdefault(device.get('area_id'), []).append(device)
+        device_entities = {}
+        for entity in entities:
+            device_entities.setdefault(entity.get('device_id'), []).append(entity['entity_id'])
+        # replace everything at once so readers never see half of a refresh
+        self.areas = {area['area_id']: area for area in areas}
+        self.floors = {floor['floor_id']: floor for floor in floors}
+        self.devices = {device['id']: device for device in devices}
+        self.entities = {entity['entity_id']: entity for entity in entities}
+        self.area_devices = area_devices
+        self.device_entities = device_entities
+
+    def is_available(self, entity_id):
+        state = self.states.get(entity_id)
+        return state is not None and state['state'] not in ('unavailable', 'unknown', 'None')
+
+    def is_hidden(self, entity_id):
+        entity = self.entities.get(entity_id)
+        return entity is not None and entity.get('hidden_by') is not None
+
+    def get_friendly_name(self, entity_id):
+        state = self.states.get(entity_id)
+        if state is None:
+            return None
+        return state['attributes'].get('friendly_name')
+
+    def get_area_entities(self, area_id, ignored_entities=()):
+        # same rules as the area templates: entities of named, enabled, non-service devices in the area
+        # that are available, not hidden and not ignored
+        area_entities = []
+        for device in self.area_devices.get(area_id, []):
+            if device.get('disabled_by') or device.get('entry_type') or not device.get('name'):
+                continue
+            for entity_id in self.device_entities.get(device['id'], []):
+                if not self.is_available(entity_id) or self.is_hidden(entity_id):
+                    continue
+                if any(ignored_entity in entity_id for ignored_entity in ignored_entities):
+                    continue
+                area_entities.append(entity_id)
+        return area_entities
+
+    def get_states_in_domain(self, domain):
+        return sorted(
+            [state for entity_id, state in list(self.states.items()) if entity_id.startswith(f'{domain}.')],
+            key=lambda state: state['entity_id']
+        )
 
 class Adapter:
     def __init__(self, config, utils):
@@ -16,62 +221,41 @@ class Adapter:
         self.person_enabled = config.get('person_enabled', False)
         self.color_loop_enabled = config.get('color_loop_enabled', False)
         self.music_assistant_enabled = config.get('music_assistant_enabled', False)
-        self.shopping_list = ""
+        self.render_cache_ttl = config.get('render_cache_ttl', 2)
+        # while HomeAssistant is down, calls to it fail right away instead of waiting for their timeout
+        self.circuit_breaker = contextlib.nullcontext()
+        if 'get_circuit_breaker' in utils:
+            self.circuit_breaker = utils['get_circuit_breaker'](f"HomeAssistant ({self.base_url})")
+        self.state_mirror = None
+        if config.get('websocket_enabled', False):
+            self.state_mirror = StateMirror(self.base_url, self.access_token, on_change=self.documents_changed)
+        # every area with its floor and the entities of its devices, as one JSON document
+        # ignored entities are filtered out afterwards
         self.areas_template = """
-        {%- for area in areas() %}
-        {
-            "area_id": "{{area}}",
-            "area_name": "{{ area_name(area) }}",
-            "type": "area",
-            {%- set ns = namespace() %}
-            {%- set ns.floor_id = "null" %}
-            {%- set ns.floor_name = "null" %}
-            {%- for floor in floors() %}
-              {%- if area in floor_areas(floor) %}
-                {%- set ns.floor_id = floor %}
-                {%- set ns.floor_name = floor_name(floor) %}
-              {%- endif %}
-            {%- endfor %}
-            "floor_id": "{{ns.floor_id}}",
-            "floor_name": "{{ns.floor_name}}"
-        },
-        {%- endfor %}
-        """
-        self.title_template = """
-{%- set ns = namespace() %}
-{%- set ns.floor_id = "null" %}
-{%- set ns.floor_name = "null" %}
-{%- for floor in floors() %}
-    {%- if "{{AREA_ID}}" in floor_areas(floor) %}
-    {%- set ns.floor_id = floor %}
-    {%- set ns.floor_name = floor_name(floor) %}
-    {%- endif %}
-{%- endfor %}
-Devices in area {{AREA_NAME}} (Area ID: {{AREA_ID}} {%- if ns.floor_id != "null" -%}, Floor ID: {{ns.floor_id}} {%- endif -%}):
-{%- set ignored_entities = {{IGNORED_ENTITIES}} %}
-  {%- for device in area_devices('{{AREA_ID}}') %}
+{%- set ns = namespace(areas=[]) %}
+{%- for area in areas() %}
+  {%- set area_ns = namespace(entities=[]) %}
+  {%- for device in area_devices(area) %}
     {%- if not device_attr(device, "disabled_by") and not device_attr(device, "entry_type") and device_attr(device, "name") %}
       {%- for entity in device_entities(device) %}
-        {%- set ns = namespace(skip_entity=False) %}
-        {%- set entity_domain = entity.split('.')[0] %}
         {%- if not is_state(entity,'unavailable') and not is_state(entity,'unknown') and not is_state(entity,"None") and not is_hidden_entity(entity) %}
-          {%- set ns.skip_entity = false %}
-          {%- for ignored_entity in ignored_entities %}
-            {%- if ignored_entity in entity|string %}
-              {%- set ns.skip_entity = true %}
-              {%- break %}
-            {%- endif %}
-          {%- endfor %}
-          {%- if ns.skip_entity == false %}
-
-{{ state_attr(entity, 'friendly_name') }} (Entity ID: {{entity}})
-
-          {%- endif %}
+          {%- set area_ns.entities = area_ns.entities + [{"entity_id": entity, "friendly_name": state_attr(entity, 'friendly_name')}] %}
         {%- endif %}
       {%- endfor %}
     {%- endif %}
   {%- endfor %}
-  """
+  {%- set floor = floor_id(area) %}
+  {%- set ns.areas = ns.areas + [{
+    "area_id": area,
+    "area_name": area_name(area),
+    "type": "area",
+    "floor_id": floor,
+    "floor_name": floor_name(floor) if floor else none,
+    "entities": area_ns.entities
+  }] %}
+{%- endfor %}
+{{ ns.areas | to_json }}
+"""
         self.summary_template = """
 {%- set ignored_entities = {{IGNORED_ENTITIES}} %}
   {%- for device in area_devices('{{AREA_ID}}') %}
@@ -243,34 +427,33 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
 {%- endif %}
 """
 
+    def start(self):
+        # called in every process answering requests, including API workers that never update plugins
+        if self.state_mirror:
+            self.state_mirror.start()
+
     def update(self):
+        self.start()
         current_initial_values = []
         if self.areas_enabled:
             areas = self.get_areas()
             for area in areas:
-                title_template_edited = self.title_template.replace('{{AREA_NAME}}', area['area_name'])
-                title_template_edited = title_template_edited.replace('{{AREA_ID}}', area['area_id'])
-                title_template_edited = title_template_edited.replace('{{IGNORED_ENTITIES}}', json.dumps(self.ignored_entities))
-                title = requests.post(f'{self.base_url}/api/template',
-                                        json={"template": title_template_edited},
-                                        headers={"Authorization": f"Bearer {self.access_token}"},
-                                        timeout=10).text
-                area['title'] = title
                 # see if we have any summary information at all
                 # if we don't, do not include the area in the initial values
-                if len(area['title'].split('\n')) > 1:
-                    area['embedding'] = self.utils['get_embedding'](title)
+                if area.pop('entities'):
                     current_initial_values.append(area)
         
         if self.shopping_list_enabled:
-            self.shopping_list = self.get_shopping_list()
+            # the items are kept in the document, so requests never see a list that is being replaced
+            shopping_list = self.get_shopping_list()
             shopping_list_text = 'Shopping list for the entire household:\n'
-            for shopping_list_item in self.shopping_list:
+            for shopping_list_item in shopping_list:
                 shopping_list_text = shopping_list_text + f"- {shopping_list_item['name']}\n"
             current_initial_values.append({
                 "type": "shopping_list",
                 "title": shopping_list_text,
-                "embedding": self.utils['get_embedding'](shopping_list_text)
+                "keywords": ["shopping list"],
+                "items": shopping_list
             })
 
         if self.laundry_enabled:
@@ -278,19 +461,15 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
             current_initial_values.append({
                 "type": "laundry",
                 "title": laundry_title,
-                "embedding": self.utils['get_embedding'](laundry_title)
+                "keywords": ["laundry", "washer", "dryer"]
             })
 
         if self.media_player_enabled:
-            summary = requests.post(f'{self.base_url}/api/template',
-                        json={"template": self.media_player_title_template},
-                        headers={"Authorization": f"Bearer {self.access_token}"},
-                        timeout=10).text
+            summary = self.get_media_player_title()
             if summary.strip():
                 current_initial_values.append({
                     "type": "media_player",
-                    "title": summary.strip(),
-                    "embedding": self.utils['get_embedding'](summary.strip())
+                    "title": summary.strip()
                 })
 
         if self.person_enabled:
@@ -298,7 +477,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
             current_initial_values.append({
                 "type": "person",
                 "title": person_title,
-                "embedding": self.utils['get_embedding'](person_title)
+                "keywords": self.get_person_names()
             })
 
         if self.color_loop_enabled:
@@ -306,36 +485,180 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
             current_initial_values.append({
                 "type": "color_loop",
                 "title": color_loop_title,
-                "embedding": self.utils['get_embedding'](color_loop_title)
+                "keywords": ["color loop", "party mode", "unicorn vomit"]
             })
 
+        # embed all titles at once so this is one or two round trips instead of one per document
+        embeddings = self.utils['get_embeddings']([value['title'] for value in current_initial_values])
+        for value, embedding in zip(current_initial_values, embeddings):
+            value['embedding'] = embedding
+
         self.current_initial_values = current_initial_values
 
     def get_areas(self):
-        areas_response = requests.post(f'{self.base_url}/api/template',
-                                    json={"template": self.areas_template},
-                                    headers={"Authorization": f"Bearer {self.access_token}"},
-                                    timeout=10)
-
-        # create a JSON from the result
-        # remove the trailing comma so the parsing wont fail
-        areas_json = f'[{areas_response.text[:-1]}]'
-        areas = json.loads(areas_json)
-        # make all area names lowercase
-        # this will help the LLM understand as different capitalization can sometimes be tokenized differently
+        if self.is_mirror_ready():
+            areas = []
+            for area_id, area in list(self.state_mirror.areas.items()):
+                floor_id = area.get('floor_id')
+                floor = self.state_mirror.floors.get(floor_id)
+                areas.append({
+                    "area_id": area_id,
+                    "area_name": area['name'],
+                    "type": "area",
+                    "floor_id": floor_id if floor else None,
+                    "floor_name": floor['name'] if floor else None,
+                    "aliases": area.get('aliases', []),
+                    "entities": [
+                        {"entity_id": entity_id, "friendly_name": self.state_mirror.get_friendly_name(entity_id)}
+                        for entity_id in self.state_mirror.get_area_entities(area_id, self.ignored_entities)
+                    ]
+                })
+        else:
+            areas = json.loads(self.render_template(self.areas_template))
+            for area in areas:
+                area['entities'] = [entity for entity in area['entities'] if not self.is_ignored_entity(entity['entity_id'])]
         for area in areas:
+            # make all area names lowercase
+            # this will help the LLM understand as different capitalization can sometimes be tokenized differently
             area['area_name'] = area['area_name'].lower()
+            area['title'] = self.get_area_title(area)
+            # what people call the area, for prompts that name it literally
+            area['keywords'] = [area['area_name'], area['area_id']] + area.pop('aliases', [])
         return areas
 
+    def is_ignored_entity(self, entity_id):
+        return any(ignored_entity in entity_id for ignored_entity in self.ignored_entities)
+
+    def get_area_title(self, area):
+        if area['floor_id']:
+            title = f"Devices in area {area['area_name']} (Area ID: {area['area_id']}, Floor ID: {area['floor_id']}):"
+        else:
+            title = f"Devices in area {area['area_name']} (Area ID: {area['area_id']}):"
+        for entity in area['entities']:
+            title = title + f"\n\n{entity['friendly_name']} (Entity ID: {entity['entity_id']})"
+        return title
+
+    def get_media_player_title(self):
+        if not self.is_mirror_ready():
+            return self.render_template(self.media_player_title_template)
+        title = "Detect, control and play media content, including songs and playlists, in specific rooms or zones within your smart home, using voice commands such as 'play hotel california in the living room' or 'resume playing music in the kitchen', and get instant access to your favorite media content with voice control."
+        for player in self.state_mirror.get_states_in_domain('media_player'):
+            title = title + f"\n- {player['attributes'].get('friendly_name')} (Entity ID: {player['entity_id']})"
+        return title
+
+    def documents_changed(self):
+        if 'request_update' in self.utils:
+            self.utils['request_update'](self)
+
+    def is_mirror_ready(self):
+        return self.state_mirror is not None and self.state_mirror.ready.is_set()
+
+    def render_template(self, template, timeout=10):
+        with self.circuit_breaker:
+            response = requests.post(f'{self.base_url}/api/template',
+                                     json={"template": template},
+                                     headers={"Authorization": f"Bearer {self.access_token}"},
+                                     timeout=timeout)
+            check_response(response)
+        return response.text
+
+    def render_request_template(self, template):
+        # don't keep waiting for HomeAssistant after the prompt had to be ready
+        timeout = 10
+        remaining_time = self.utils['get_remaining_time']() if 'get_remaining_time' in self.utils else None
+        if remaining_time is not None:
+            timeout = max(min(timeout, remaining_time), 0.1)
+        # templates rendered while answering a prompt are rendered once for everyone asking at the same time
+        # (across users sharing this HomeAssistant) and the result is reused for render_cache_ttl seconds
+        if 'single_flight' not in self.utils:
+            return self.render_template(template, timeout)
+        return self.utils['single_flight'](('homeassistant', self.base_url, template), lambda: self.render_template(template, timeout), self.render_cache_ttl)
+
+    def get_area_summary(self, document):
+        if not self.is_mirror_ready():
+            summary_template_edited = self.summary_template.replace('{{AREA_NAME}}', document['area_name'])
+            summary_template_edited = summary_template_edited.replace('{{AREA_ID}}', document['area_id'])
+            summary_template_edited = summary_template_edited.replace('{{IGNORED_ENTITIES}}', json.dumps(self.ignored_entities))
+            return self.render_request_template(summary_template_edited)
+        summary = []
+        for entity_id in self.state_mirror.get_area_entities(document['area_id'], self.ignored_entities):
+            # the websocket thread may have removed the entity since it was listed
+            state = self.state_mirror.states.get(entity_id)
+            if state is None:
+                continue
+            friendly_name = state['attributes'].get('friendly_name')
+            brightness = state['attributes'].get('brightness')
+            if entity_id.startswith('light.') and brightness:
+                summary.append(f"{friendly_name} (Entity ID: {entity_id}) is {state['state']} with a brightness of {int(float(brightness) / 255 * 100)}%")
+            else:
+                summary.append(f"{friendly_name} (Entity ID: {entity_id}) is {state['state']}")
+        return '\n\n'.join(summary)
+
+    def get_area_lights_status(self, document):
+        if not self.is_mirror_ready():
+            area_lights_template_edited = self.area_lights_template.replace('{{AREA_NAME}}', document['area_name'])
+            area_lights_template_edited = area_lights_template_edited.replace('{{AREA_ID}}', document['area_id'])
+            return self.render_request_template(area_lights_template_edited)
+        # like area_entities(), this includes entities assigned to the area directly and through their device
+        lights_on = False
+        for entity_id, entity in list(self.state_mirror.entities.items()):
+            if not entity_id.startswith('light'):
+                continue
+            area_id = entity.get('area_id')
+            if not area_id and entity.get('device_id') in self.state_mirror.devices:
+                area_id = self.state_mirror.devices[entity['device_id']].get('area_id')
+            state = self.state_mirror.states.get(entity_id)
+            if area_id == document['area_id'] and state is not None and state['state'] == 'on':
+                lights_on = True
+                break
+        if lights_on:
+            return f"The {document['area_name']} lights are on."
+        return f"The {document['area_name']} lights are off."
+
+    def get_media_player_summary(self):
+        if not self.is_mirror_ready():
+            return self.render_request_template(self.media_player_template)
+        summary = []
+        for player in self.state_mirror.get_states_in_domain('media_player'):
+            if player['state'] == 'playing':
+                attributes = player['attributes']
+                summary.append(f"{attributes.get('friendly_name')} (Entity ID: {player['entity_id']}) is playing {attributes.get('media_title')} by {attributes.get('media_artist')}.")
+        return '\n'.join(summary)
+
+    def get_person_summary(self):
+        if not self.is_mirror_ready():
+            return self.render_request_template(self.person_template)
+        summary = []
+        for person in self.state_mirror.get_states_in_domain('person'):
+            name = person['attributes'].get('friendly_name', person['entity_id'].split('.', 1)[1])
+            summary.append(f"{name} is {'home' if person['state'] == 'home' else 'not home'}.")
+        return '\n\n'.join(summary)
+
+    def get_person_names(self):
+        # only known when mirroring, we'd rather not render another template on every update for this
+        if not self.is_mirror_ready():
+            return []
+        return [person['attributes'].get('friendly_name', person['entity_id'].split('.', 1)[1]) for person in self.state_mirror.get_states_in_domain('person')]
+
     def get_music_assistant_entities(self):
-        music_assistant_entities_response = requests.post(f'{self.base_url}/api/template',
-                                    json={"template": self.mass_media_player_json_template},
-                                    headers={"Authorization": f"Bearer {self.access_token}"},
-                                    timeout=10)
+        if self.is_mirror_ready():
+            music_assistant_entities = []
+            for area_id, area in list(self.state_mirror.areas.items()):
+                for entity_id in self.state_mirror.get_area_entities(area_id):
+                    state = self.state_mirror.states.get(entity_id)
+                    if entity_id.startswith('media_player.') and state is not None and state['attributes'].get('app_id'):
+                        music_assistant_entities.append({
+                            "entity_id": entity_id,
+                            "entity_name": (self.state_mirror.get_friendly_name(entity_id) or '').lower(),
+                            "area_name": area['name'],
+                            "area_id": area_id
+                        })
+            return music_assistant_entities
+        music_assistant_entities_text = self.render_request_template(self.mass_media_player_json_template)
 
         # create a JSON from the result
         # remove the trailing comma so the parsing wont fail
-        music_assistant_entities_json = f'[{music_assistant_entities_response.text[:-1]}]'
+        music_assistant_entities_json = f'[{music_assistant_entities_text[:-1]}]'
         music_assistant_entities = json.loads(music_assistant_entities_json)
         # make all music player names lowercase
         # this will help the LLM understand as different capitalization can sometimes be tokenized differently
@@ -344,9 +667,11 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
         return music_assistant_entities
 
     def get_shopping_list(self):
-        shopping_list_response = requests.get(f'{self.base_url}/api/shopping_list',
-                                            headers={"Authorization": f"Bearer {self.access_token}"}, 
-                                            timeout=10)
+        with self.circuit_breaker:
+            shopping_list_response = requests.get(f'{self.base_url}/api/shopping_list',
+                                                headers={"Authorization": f"Bearer {self.access_token}"}, 
+                                                timeout=10)
+            check_response(shopping_list_response)
 
         shopping_list = shopping_list_response.json()
         return shopping_list
@@ -359,9 +684,10 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
         llm_prompt = ""
         match document['type']:
             case "shopping_list":
-                if self.shopping_list:
+                shopping_list = document['items']
+                if shopping_list:
                     llm_prompt = llm_prompt + 'Shopping list contents:\n'
-                    for shopping_list_item in self.shopping_list:
+                    for shopping_list_item in shopping_list:
                         llm_prompt = llm_prompt + f"- {shopping_list_item['name']}\n"
                     llm_prompt = llm_prompt + '\n Do not add anything to the shopping list if it is already there!'
                 else:
@@ -373,8 +699,8 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
                     )
                 )
                 sample_shopping_list_item = 'chicken'
-                if self.shopping_list:
-                    sample_shopping_list_item = random.choice(self.shopping_list)['name']
+                if shopping_list:
+                    sample_shopping_list_item = random.choice(shopping_list)['name']
                 examples.append(
                     (
                         'Remove ' + sample_shopping_list_item + ' from the shopping list.',
@@ -388,13 +714,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
                     )
                 )
             case "area":
-                summary_template_edited = self.summary_template.replace('{{AREA_NAME}}', document['area_name'])
-                summary_template_edited = summary_template_edited.replace('{{AREA_ID}}', document['area_id'])
-                summary_template_edited = summary_template_edited.replace('{{IGNORED_ENTITIES}}', json.dumps(self.ignored_entities))
-                summary = requests.post(f'{self.base_url}/api/template',
-                                        json={"template": summary_template_edited},
-                                        headers={"Authorization": f"Bearer {self.access_token}"},
-                                        timeout=10).text
+                summary = self.get_area_summary(document)
                 if document['floor_id'] and document['floor_name']:
                     llm_prompt = llm_prompt + f"""
 {document['area_name']} (Area ID: {document['area_id']}, located {document['floor_name']}, Floor ID: {document['floor_id']}):
@@ -422,12 +742,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
                     )
                 )
 
-                area_lights_template_edited = self.area_lights_template.replace('{{AREA_NAME}}', document['area_name'])
-                area_lights_template_edited = area_lights_template_edited.replace('{{AREA_ID}}', document['area_id'])
-                area_lights_status = requests.post(f'{self.base_url}/api/template',
-                        json={"template": area_lights_template_edited},
-                        headers={"Authorization": f"Bearer {self.access_token}"},
-                        timeout=10).text
+                area_lights_status = self.get_area_lights_status(document)
                 examples.append(
                     (
                         f'Are the {document["area_name"]} lights on?',
@@ -442,10 +757,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
                     )
                 )
             case "laundry":
-                summary = requests.post(f'{self.base_url}/api/template',
-                                        json={"template": self.laundry_template},
-                                        headers={"Authorization": f"Bearer {self.access_token}"},
-                                        timeout=10).text
+                summary = self.render_request_template(self.laundry_template)
 
                 llm_prompt = llm_prompt + f"""
 
@@ -453,10 +765,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
 
                 """
             case "media_player":
-                summary = requests.post(f'{self.base_url}/api/template',
-                                        json={"template": self.media_player_template},
-                                        headers={"Authorization": f"Bearer {self.access_token}"},
-                                        timeout=10).text
+                summary = self.get_media_player_summary()
                 if not summary.strip():
                     summary = "No media is playing in the household right now."
 
@@ -481,10 +790,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
                             )
                         )
             case "person":
-                summary = requests.post(f'{self.base_url}/api/template',
-                                        json={"template": self.person_template},
-                                        headers={"Authorization": f"Bearer {self.access_token}"},
-                                        timeout=10).text
+                summary = self.get_person_summary()
 
                 llm_prompt = llm_prompt + f"""
 
@@ -492,10 +798,7 @@ Party mode is disabled. Run service named script.enable_party_mode to enable.
 
                 """
             case "color_loop":
-                summary = requests.post(f'{self.base_url}/api/template',
-                                        json={"template": self.color_loop_template},
-                                        headers={"Authorization": f"Bearer {self.access_token}"},
-                                        timeout=10).text
+                summary = self.render_request_template(self.color_loop_template)
 
                 llm_prompt = llm_prompt + f"""
 
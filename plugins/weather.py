@@ -24,19 +24,32 @@ class Adapter:
             "text_summary",
             "Forecast"
         ]
+        self.documents = []
 
     def update(self):
-        asyncio.run(self.ECWeather.update())
+        asyncio.run(self.update_async())
 
-    def get_documents(self):
+    async def update_async(self):
+        await self.ECWeather.update()
+        # ECWeather changes its conditions in place while updating, so the prompt is rendered here
+        # and requests only ever read the one stored in the document
+        llm_prompt = "Current weather conditions: " + self.augment_summary(self.ECWeather.conditions)
+        for forecast in self.ECWeather.daily_forecasts:
+            summary = f"{forecast['text_summary']} Expected temperature: {forecast['temperature']}"
+            llm_prompt = llm_prompt + f"\nWeather forecast for {forecast['period']}: {summary}"
         # for now, let's only give one category for the weather
         title = "The current weather conditions and weather forecast for the next week."
-        return [
+        self.documents = [
             {
                 "title": title,
-                "embedding": self.utils['get_embedding'](title)
+                "embedding": await self.utils['get_embedding_async'](title),
+                "keywords": ["weather", "forecast"],
+                "prompt": llm_prompt
             }
         ]
+
+    def get_documents(self):
+        return self.documents
     
     def augment_summary(self, data):
         summary = []
@@ -63,17 +76,11 @@ class Adapter:
 
         return augmented_summary
 
-    def get_llm_prompt_addition(self, selected_categories, user_prompt):
-        llm_prompt = ""
+    def get_llm_prompt_addition(self, document, user_prompt):
         # we don't need examples as the weather tends to be fairly self-explanatory
         examples = []
-
-        llm_prompt = "Current weather conditions: " + self.augment_summary(self.ECWeather.conditions)
-        for forecast in self.ECWeather.daily_forecasts:
-            summary = f"{forecast['text_summary']} Expected temperature: {forecast['temperature']}"
-            llm_prompt = llm_prompt + f"\nWeather forecast for {forecast['period']}: {summary}"
         return {
-            "prompt": llm_prompt,
+            "prompt": document['prompt'],
             "examples": examples
         }
 
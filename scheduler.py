@@ -0,0 +1,125 @@
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class UpdateScheduler:
+    # runs plugin updates concurrently in a bounded pool of worker threads
+    # every plugin has its own interval and jitter, failed updates are retried with exponential backoff
+    # and a plugin is never updated twice at the same time
+    def __init__(self, run_update, max_workers, on_timeout=None):
+        self.run_update = run_update
+        self.on_timeout = on_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='update')
+        self.condition = threading.Condition()
+        self.jobs = {}
+        self.thread = None
+
+    def add(self, key, name, plugin, interval, jitter=0, timeout=None, retry_delay=30):
+        with self.condition:
+            self.jobs[key] = {
+                "name": name,
+                "plugin": plugin,
+                "interval": interval,
+                "jitter": jitter,
+                "timeout": timeout,
+                "retry_delay": retry_delay,
+                "next_run": time.monotonic() + interval + random.uniform(0, jitter),
+                "failures": 0,
+                "future": None,
+                "started": None,
+                "timed_out": False,
+                "run_again": None
+            }
+            self.condition.notify()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def schedule(self, key, delay=0):
+        # runs the plugin in delay seconds, unless it is already going to run sooner than that
+        with self.condition:
+            job = self.jobs[key]
+            if job['future'] is not None:
+                # it is updating right now, but that update may have missed whatever changed
+                job['run_again'] = delay if job['run_again'] is None else min(job['run_again'], delay)
+                return
+            job['next_run'] = min(job['next_run'], time.monotonic() + delay)
+            self.condition.notify()
+
+    def run_now(self, keys=None):
+        # starts the given plugins (or all of them) right away and returns a future per plugin
+        # plugins that are already updating are not started again, their current update is returned instead
+        # and they are updated once more right after it, in case it started before whatever we are updating for
+        with self.condition:
+            futures = {}
+            for key in keys if keys is not None else list(self.jobs):
+                job = self.jobs[key]
+                if job['future'] is None:
+                    self.submit(key)
+                else:
+                    job['run_again'] = 0
+                futures[key] = job['future']
+            return futures
+
+    def submit(self, key):
+        job = self.jobs[key]
+        job['started'] = time.monotonic()
+        job['timed_out'] = False
+        job['next_run'] = math.inf
+        job['future'] = self.executor.submit(self.run_job, key)
+
+    def run_job(self, key):
+        # the future of every update resolves to its duration and error, it never raises
+        job = self.jobs[key]
+        error = None
+        try:
+            self.run_update(job['plugin'], job['timeout'])
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        with self.condition:
+            now = time.monotonic()
+            if job['timed_out'] and error is None:
+                error = f"did not finish within {job['timeout']} seconds"
+            if error is None:
+                job['failures'] = 0
+                job['next_run'] = now + job['interval'] + random.uniform(0, job['jitter'])
+            else:
+                job['failures'] += 1
+                job['next_run'] = now + min(job['retry_delay'] * 2 ** (job['failures'] - 1), job['interval'])
+                logger.warning(f"Update of plugin {job['name']} failed {job['failures']} times in a row, retrying in {job['next_run'] - now:.0f} seconds")
+            if job['run_again'] is not None:
+                job['next_run'] = min(job['next_run'], now + job['run_again'])
+                job['run_again'] = None
+            job['future'] = None
+            self.condition.notify()
+            return {"duration": now - job['started'], "error": error}
+
+    def run(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                wake_up = math.inf
+                for key, job in self.jobs.items():
+                    if job['future'] is None:
+                        if job['next_run'] > now:
+                            wake_up = min(wake_up, job['next_run'])
+                            continue
+                        self.submit(key)
+                    if job['timeout'] and not job['timed_out']:
+                        deadline = job['started'] + job['timeout']
+                        if deadline <= now:
+                            # threads can't be killed, but we stop waiting for it and count it as a failure
+                            job['timed_out'] = True
+                            logger.error(f"Update of plugin {job['name']} did not finish within {job['timeout']} seconds")
+                            if self.on_timeout:
+                                self.on_timeout(job['plugin'])
+                        else:
+                            wake_up = min(wake_up, deadline)
+                self.condition.wait(None if wake_up == math.inf else wake_up - now)
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+
+class SingleFlight:
+    # threads calling run() with the same key while a call is in flight wait for it and share its result
+    # with a ttl, the result is also kept and returned to anyone asking for the same key within ttl seconds
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.results = {}
+
+    def run(self, key, function, ttl=0):
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None and result[1] > time.monotonic():
+                return result[0]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = function()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                now = time.monotonic()
+                if call['error'] is None and ttl:
+                    self.results[key] = (call['result'], now + ttl)
+                    for expired_key in [cached_key for cached_key, (_, expires) in self.results.items() if expires <= now]:
+                        del self.results[expired_key]
+            call['done'].set()
+        return call['result']
+
+class AsyncSingleFlight:
+    # coroutines awaiting run() with the same key while a call is in flight share its task
+    # a caller that is cancelled doesn't cancel the call for everyone else
+    def __init__(self):
+        self.tasks = {}
+
+    async def run(self, key, coroutine_function):
+        loop = asyncio.get_running_loop()
+        # tasks can only be awaited in their own event loop
+        key = (id(loop), key)
+        task = self.tasks.get(key)
+        if task is None:
+            task = loop.create_task(coroutine_function())
+            self.tasks[key] = task
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+        return await asyncio.shield(task)
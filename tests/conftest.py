@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# main reads its configuration on import, so tests that import it all share this one
+# nothing is stored on disk and nothing is cached, tests change main.config as they need
+config_directory = tempfile.mkdtemp()
+with open(os.path.join(config_directory, 'config.json'), 'w') as f:
+    json.dump({
+        "embedding_api_key": "key",
+        "embedding_base_url": "http://127.0.0.1:1/v1",
+        "embedding_model": "model",
+        "embedding_timeout": 2,
+        "number_of_results": 3,
+        "log_level": 30,
+        "update_interval": 3600,
+        "embedding_cache_path": None,
+        "index_snapshot_path": None,
+        "query_cache_size": 0
+    }, f)
+os.environ['CONFIG_PATH'] = os.path.join(config_directory, 'config.json')
+
+class EmbeddingServer:
+    # a fake embedding API, every text is embedded as the counts of the letters a to z in it
+    def __init__(self):
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append(data)
+                texts = data['input'] if isinstance(data['input'], list) else [data['input']]
+                body = json.dumps({"data": [{"index": i, "embedding": server.embed(text)} for i, text in enumerate(texts)]}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.http_server.server_address[1]}/v1"
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def embed(self, text):
+        return [float(text.lower().count(letter)) + 0.01 for letter in 'abcdefghijklmnopqrstuvwxyz']
+
+@pytest.fixture
+def embedding_server():
+    server = EmbeddingServer()
+    yield server
+    server.http_server.shutdown()
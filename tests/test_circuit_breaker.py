@@ -0,0 +1,102 @@
+import asyncio
+import time
+import pytest
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+class ServiceError(Exception):
+    pass
+
+def get_breaker():
+    states = []
+    breaker = CircuitBreaker("service", failure_threshold=2, reset_timeout=0.05, max_reset_timeout=0.15,
+                             on_state_change=lambda name, state: states.append(state), failure_exceptions=(ServiceError,))
+    return breaker, states
+
+def call(breaker, exception=None):
+    with breaker:
+        if exception is not None:
+            raise exception
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(ServiceError):
+            call(breaker, ServiceError())
+
+def test_opens_after_failures_in_a_row():
+    breaker, states = get_breaker()
+    with pytest.raises(ServiceError):
+        call(breaker, ServiceError())
+    call(breaker)
+    with pytest.raises(ServiceError):
+        call(breaker, ServiceError())
+    assert breaker.state == "closed"
+    with pytest.raises(ServiceError):
+        call(breaker, ServiceError())
+    assert states == ["open"]
+    with pytest.raises(CircuitOpenError):
+        call(breaker)
+    assert breaker.get_status()['retry_in'] > 0
+
+def test_probe_succeeds():
+    breaker, states = get_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    call(breaker)
+    assert states == ["open", "half_open", "closed"]
+    assert breaker.failures == 0
+
+def test_only_one_probe_at_a_time():
+    breaker, states = get_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    with breaker:
+        with pytest.raises(CircuitOpenError):
+            call(breaker)
+    assert breaker.state == "closed"
+
+def test_probe_fails():
+    breaker, states = get_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    with pytest.raises(ServiceError):
+        call(breaker, ServiceError())
+    assert states == ["open", "half_open", "open"]
+    # open twice as long as before
+    assert breaker.open_timeout == pytest.approx(0.1)
+    time.sleep(0.06)
+    with pytest.raises(CircuitOpenError):
+        call(breaker)
+    time.sleep(0.05)
+    with pytest.raises(ServiceError):
+        call(breaker, ServiceError())
+    # up to max_reset_timeout
+    assert breaker.open_timeout == pytest.approx(0.15)
+
+def test_probe_cancelled():
+    breaker, states = get_breaker()
+    open_breaker(breaker)
+    time.sleep(0.06)
+    with pytest.raises(asyncio.CancelledError):
+        call(breaker, asyncio.CancelledError())
+    # nothing was learned about the service, the next call probes it right away
+    assert states == ["open", "half_open", "open"]
+    assert breaker.open_timeout == pytest.approx(0.05)
+    assert breaker.failures == 2
+    call(breaker)
+    assert breaker.state == "closed"
+
+def test_other_exceptions_do_not_count():
+    breaker, states = get_breaker()
+    for _ in range(5):
+        with pytest.raises(RuntimeError):
+            call(breaker, RuntimeError("a bug"))
+    assert states == []
+    assert breaker.failures == 0
+    # and release the probe like a cancellation
+    open_breaker(breaker)
+    time.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        call(breaker, RuntimeError("a bug"))
+    assert breaker.state == "open"
+    call(breaker)
+    assert breaker.state == "closed"
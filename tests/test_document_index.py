@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from document_index import DocumentSegment, DocumentIndex, tokenize
+
+def get_index():
+    lights = DocumentSegment("lights", [
+        {"title": "Office lights light.office_overhead_left", "embedding": [1.0, 0.0, 0.0], "keywords": ["office"]},
+        {"title": "Kitchen lights", "embedding": [0.0, 1.0, 0.0], "keywords": ["kitchen"]},
+        {"title": "Garage door", "embedding": None}
+    ])
+    weather = DocumentSegment("weather", [
+        {"title": "The current weather and forecast", "embedding": [0.0, 0.0, 2.0], "keywords": ["weather"]}
+    ])
+    return DocumentIndex([lights, None, weather])
+
+def get_titles(results):
+    return [result['document']['title'] for result in results]
+
+def test_tokenize_entity_ids():
+    assert tokenize("Is light.office_overhead_left on?") == ["is", "light.office_overhead_left", "light", "office", "overhead", "left", "on"]
+
+def test_segment_keeps_documents_without_embeddings():
+    index = get_index()
+    assert len(index) == 4
+    assert index.plugin_names == ["lights", "lights", "lights", "weather"]
+    assert list(index.embedded) == [0, 1, 3]
+    assert 'embedding' not in index.documents[0]
+    assert np.linalg.norm(index.matrices[1][0]) == pytest.approx(1)
+
+def test_vector_search():
+    results = get_index().search([0.1, 0.0, 1.0], 2)
+    assert get_titles(results) == ["The current weather and forecast", "Office lights light.office_overhead_left"]
+    assert results[0]['plugin_name'] == "weather"
+    assert results[0]['similarity'] == pytest.approx(1 / np.linalg.norm([0.1, 0.0, 1.0]))
+    # documents without an embedding are never found by their embedding
+    assert "Garage door" not in get_titles(get_index().search([0.0, 1.0, 1.0], 10))
+
+def test_lexical_search():
+    index = get_index()
+    assert get_titles(index.search_lexical("open garage door", 3)) == ["Garage door"]
+    # the entity ID matches spelled out and word by word
+    assert get_titles(index.search_lexical("light.office_overhead_left", 3))[0] == "Office lights light.office_overhead_left"
+    assert get_titles(index.search_lexical("overhead left", 3)) == ["Office lights light.office_overhead_left"]
+    # rarer terms weigh more
+    assert get_titles(index.search_lexical("kitchen lights", 3)) == ["Kitchen lights", "Office lights light.office_overhead_left"]
+    assert index.search_lexical("nothing matches", 3) == []
+
+def test_hybrid_search():
+    index = get_index()
+    # first by embedding and by words beats first by embedding alone
+    results = index.search_hybrid("kitchen lights", [0.7, 0.71, 0.0], 3, rrf_k=60)
+    assert get_titles(results)[:2] == ["Kitchen lights", "Office lights light.office_overhead_left"]
+    assert results[0]['score'] == pytest.approx(2 / 61)
+    # documents without an embedding are found by their words, without a similarity
+    results = {result['document']['title']: result for result in index.search_hybrid("garage door", [0.0, 0.0, 1.0], 4)}
+    assert len(results) == 4
+    assert results["Garage door"]['similarity'] is None
+    assert results["Garage door"]['score'] == pytest.approx(1 / 61)
+
+def test_mismatched_embeddings_are_only_found_by_words():
+    lights = DocumentSegment("lights", [{"title": "Office lights", "embedding": [1.0, 0.0, 0.0]}])
+    other = DocumentSegment("other", [{"title": "Other model", "embedding": [1.0, 0.0]}])
+    index = DocumentIndex([lights, other])
+    assert len(index.matrices) == 1
+    assert get_titles(index.search([1.0, 0.0, 0.0], 5)) == ["Office lights"]
+    assert get_titles(index.search_lexical("other model", 5)) == ["Other model"]
+
+def test_route():
+    index = get_index()
+    assert get_titles(index.route("is it warmer in the kitchen or the office", 3)) == ["Kitchen lights", "Office lights light.office_overhead_left"]
+    assert get_titles(index.route("weather in the office and the office", 1)) == ["The current weather and forecast"]
+    assert index.route("what time is it", 3) == []
+
+def test_documents_returned_again_keep_their_embeddings():
+    previous = DocumentSegment("lights", [{"title": "Office lights", "embedding": [1.0, 0.0, 0.0]}, {"title": "Garage door", "embedding": None}])
+    segment = DocumentSegment("lights", [{"title": "Office lights"}, {"title": "Garage door"}, {"title": "Kitchen lights", "embedding": [0.0, 2.0, 0.0]}], previous=previous)
+    assert list(segment.embedded) == [0, 2]
+    assert segment.matrix[0] == pytest.approx([1.0, 0.0, 0.0])
+    assert segment.matrix[1] == pytest.approx([0.0, 1.0, 0.0])
+
+def test_memory_usage(tmp_path):
+    segment = DocumentSegment("calendar", [{"title": "Events", "embedding": [1.0, 0.0], "events": [("Dentist", "Monday")] * 100}])
+    memory_usage = segment.get_memory_usage()
+    assert memory_usage['embeddings'] == 8
+    assert memory_usage['mapped_embeddings'] == 0
+    # everything the documents contain is counted, but the same event only once
+    assert 800 < memory_usage['documents'] < 2000
+    np.save(tmp_path / 'matrix.npy', segment.matrix)
+    mapped = DocumentSegment("calendar", segment.documents, np.load(tmp_path / 'matrix.npy', mmap_mode='r'))
+    assert mapped.get_memory_usage()['embeddings'] == 0
+    assert mapped.get_memory_usage()['mapped_embeddings'] == 8
@@ -0,0 +1,41 @@
+import numpy as np
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), 100)
+    assert cache.get("model", "kitchen") is None
+    cache.put("model", "kitchen", [1.0, 2.0])
+    assert list(cache.get("model", "kitchen")) == [1.0, 2.0]
+    assert cache.get("other model", "kitchen") is None
+    cache.put("model", "kitchen", np.array([3.0, 4.0]))
+    assert list(cache.get("model", "kitchen")) == [3.0, 4.0]
+    assert cache.count() == 1
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'), 10, check_interval=1)
+    for i in range(10):
+        cache.put("model", f"text {i}", [float(i)])
+    cache.get("model", "text 0")
+    cache.put("model", "text 10", [10.0])
+    assert cache.count() == 9
+    assert cache.get("model", "text 0") is not None
+    assert cache.get("model", "text 1") is None
+    assert cache.get("model", "text 10") is not None
+
+def test_processes_sharing_the_cache_evict_together(tmp_path):
+    # every process has its own connection, but they all count the entries in the database
+    caches = [EmbeddingCache(str(tmp_path / 'cache.sqlite3'), 50, check_interval=5) for _ in range(4)]
+    for i in range(100):
+        for j, cache in enumerate(caches):
+            cache.put("model", f"text {i} {j}", [float(i)])
+    assert caches[0].count() <= 50 + 4 * 5
+
+def test_query_cache_normalizes_prompts():
+    cache = QueryEmbeddingCache(2, 60)
+    cache.put("model", "Turn off the lights.", "embedding")
+    assert cache.get("model", "turn off  the lights") == "embedding"
+    cache.put("model", "second", "2")
+    cache.put("model", "third", "3")
+    assert cache.get("model", "turn off the lights") is None
+    assert cache.get("model", "second") == "2"
+    assert cache.get("model", "third") == "3"
@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+import main
+
+@pytest.fixture
+def embedding_api(embedding_server):
+    base_url = main.config['embedding_base_url']
+    main.config['embedding_base_url'] = embedding_server.url
+    main.embedding_circuit_breaker.record_success()
+    yield embedding_server
+    main.config['embedding_base_url'] = base_url
+
+class AsyncAdapter:
+    def __init__(self, titles):
+        self.titles = titles
+        self.embeddings = None
+
+    async def update_async(self):
+        self.embeddings = await asyncio.gather(*(main.get_embedding_async(title) for title in self.titles))
+
+def test_get_embedding_async_from_update_async(embedding_api):
+    # update_async() runs in an event loop of its own, not the one of the API
+    plugin = {"name": "async", "class": AsyncAdapter(["kitchen lights", "weather"])}
+    with TestClient(main.app):
+        main.update_plugin(plugin, 5)
+        main.update_plugin(plugin, 5)
+    assert [embedding[0] for embedding in plugin['class'].embeddings] == pytest.approx([0.01, 1.01])
+    assert main.embedding_circuit_breaker.get_status()['failures'] == 0
+    assert len(embedding_api.requests) == 4
+
+def test_get_embedding_async_without_api(embedding_api):
+    # the updater process of api_workers never starts the API
+    plugin = {"name": "async", "class": AsyncAdapter(["kitchen lights"])}
+    main.update_plugin(plugin, 5)
+    assert plugin['class'].embeddings[0] is not None
+
+def test_get_embedding_async_in_api(embedding_api):
+    with TestClient(main.app) as client:
+        embedding = client.portal.call(main.get_embedding_async, "lights")
+    assert embedding[11] == pytest.approx(1.01)
+    assert main.embedding_circuit_breaker.get_status()['failures'] == 0
+
+def test_bugs_do_not_open_the_circuit_breaker(embedding_api, monkeypatch):
+    class BrokenSession:
+        def post(self, *args, **kwargs):
+            raise RuntimeError("Timeout context manager should be used inside a task")
+    async def get_broken_session():
+        return BrokenSession()
+    monkeypatch.setattr(main, 'get_embedding_client_session', get_broken_session)
+    for _ in range(10):
+        assert asyncio.run(main.post_embeddings_async({"model": "model", "input": "lights"})) is None
+    assert main.embedding_circuit_breaker.get_status()['state'] == 'closed'
+    assert main.embedding_circuit_breaker.get_status()['failures'] == 0
+
+def test_concurrent_prompts_share_one_request(embedding_api, monkeypatch):
+    monkeypatch.setattr(main, 'query_embedding_cache', main.QueryEmbeddingCache(10, 60))
+    async def embed_concurrently():
+        return await asyncio.gather(*(main.get_embedding_async(prompt) for prompt in ["Turn off the lights.", "turn off the lights", "turn off  the lights"]))
+    with TestClient(main.app) as client:
+        embeddings = client.portal.call(embed_concurrently)
+    assert all(embedding is not None for embedding in embeddings)
+    assert len(embedding_api.requests) == 1
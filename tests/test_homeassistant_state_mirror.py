@@ -0,0 +1,158 @@
+import asyncio
+import importlib.util
+import os
+from aiohttp import web
+
+spec = importlib.util.spec_from_file_location('homeassistant', os.path.join(os.path.dirname(__file__), '..', 'plugins', 'homeassistant.py'))
+homeassistant = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(homeassistant)
+
+class HomeAssistantStub:
+    # just enough of Home Assistant's websocket API for the state mirror
+    def __init__(self):
+        self.states = [
+            {"entity_id": "light.office", "state": "on", "attributes": {"friendly_name": "Office Light"}},
+            {"entity_id": "sensor.office_battery", "state": "unavailable", "attributes": {"friendly_name": "Office Battery"}}
+        ]
+        self.areas = [{"area_id": "office", "name": "Office", "floor_id": None}]
+        self.devices = [{"id": "lamp", "area_id": "office", "name": "Lamp", "disabled_by": None, "entry_type": None}]
+        self.entities = [
+            {"entity_id": "light.office", "device_id": "lamp", "hidden_by": None},
+            {"entity_id": "sensor.office_battery", "device_id": "lamp", "hidden_by": None}
+        ]
+        self.connections = 0
+        self.commands = []
+        self.websockets = []
+        self.registry_delay = 0
+
+    async def handle(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.connections += 1
+        self.websockets.append(websocket)
+        await websocket.send_json({"type": "auth_required"})
+        message = await websocket.receive_json()
+        if message.get('access_token') != 'token':
+            await websocket.send_json({"type": "auth_invalid", "message": "invalid token"})
+            await websocket.close()
+            return websocket
+        await websocket.send_json({"type": "auth_ok"})
+        async for message in websocket:
+            command = message.json()
+            self.commands.append(command['type'])
+            results = {
+                "get_states": self.states,
+                "config/area_registry/list": self.areas,
+                "config/device_registry/list": self.devices,
+                "config/entity_registry/list": self.entities
+            }
+            if command['type'] == 'config/floor_registry/list':
+                await websocket.send_json({"id": command['id'], "type": "result", "success": False, "error": {"message": "unknown command"}})
+                continue
+            if command['type'] in results and command['type'] != 'get_states':
+                await asyncio.sleep(self.registry_delay)
+            await websocket.send_json({"id": command['id'], "type": "result", "success": True, "result": results.get(command['type'])})
+        return websocket
+
+    async def send_event(self, event_type, data=None):
+        await self.websockets[-1].send_json({"id": 1, "type": "event", "event": {"event_type": event_type, "data": data or {}}})
+
+async def start_stub(stub):
+    app = web.Application()
+    app.router.add_get('/api/websocket', stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+def run_with_mirror(test):
+    async def run():
+        stub = HomeAssistantStub()
+        runner, base_url = await start_stub(stub)
+        changes = []
+        mirror = homeassistant.StateMirror(base_url, 'token', on_change=lambda: changes.append(True), reconnect_interval=0.05)
+        task = asyncio.create_task(mirror.run())
+        try:
+            await wait_for(mirror.ready.is_set)
+            await test(stub, mirror, changes)
+        finally:
+            task.cancel()
+            await runner.cleanup()
+    asyncio.run(run())
+
+def test_sync():
+    async def test(stub, mirror, changes):
+        assert mirror.get_friendly_name('light.office') == 'Office Light'
+        assert mirror.get_area_entities('office') == ['light.office']
+        assert mirror.floors == {}
+        # subscribed before fetching anything
+        assert stub.commands.index('get_states') > stub.commands.index('subscribe_events')
+    run_with_mirror(test)
+
+def test_state_changed():
+    async def test(stub, mirror, changes):
+        await stub.send_event('state_changed', {"entity_id": "light.office", "new_state": {"entity_id": "light.office", "state": "off", "attributes": {"friendly_name": "Office Light"}}})
+        await wait_for(lambda: mirror.states['light.office']['state'] == 'off')
+        # still available, the documents don't change
+        assert changes == []
+        await stub.send_event('state_changed', {"entity_id": "sensor.office_battery", "new_state": {"entity_id": "sensor.office_battery", "state": "50", "attributes": {}}})
+        await wait_for(lambda: changes)
+        assert mirror.get_area_entities('office') == ['light.office', 'sensor.office_battery']
+        await stub.send_event('state_changed', {"entity_id": "light.office", "new_state": None})
+        await wait_for(lambda: 'light.office' not in mirror.states)
+    run_with_mirror(test)
+
+def test_registry_updates_are_coalesced():
+    async def test(stub, mirror, changes):
+        stub.registry_delay = 0.05
+        stub.devices = stub.devices + [{"id": "fan", "area_id": "office", "name": "Fan", "disabled_by": None, "entry_type": None}]
+        stub.entities = stub.entities + [{"entity_id": "switch.office_fan", "device_id": "fan", "hidden_by": None}]
+        stub.states = stub.states + [{"entity_id": "switch.office_fan", "state": "off", "attributes": {}}]
+        await stub.send_event('state_changed', {"entity_id": "switch.office_fan", "new_state": stub.states[-1]})
+        await wait_for(lambda: 'switch.office_fan' in mirror.states)
+        changes.clear()
+        refreshes = stub.commands.count('config/area_registry/list')
+        for _ in range(10):
+            await stub.send_event('device_registry_updated')
+        await wait_for(lambda: changes)
+        await asyncio.sleep(0.3)
+        # the first event starts a refresh, the others are handled by a single one after it
+        assert stub.commands.count('config/area_registry/list') - refreshes <= 2
+        assert changes == [True]
+        assert 'switch.office_fan' in mirror.get_area_entities('office')
+    run_with_mirror(test)
+
+def test_reconnect():
+    async def test(stub, mirror, changes):
+        await stub.websockets[-1].close()
+        await wait_for(lambda: stub.connections == 2 and mirror.ready.is_set())
+        assert mirror.get_area_entities('office') == ['light.office']
+        await stub.send_event('state_changed', {"entity_id": "light.office", "new_state": {"entity_id": "light.office", "state": "off", "attributes": {}}})
+        await wait_for(lambda: mirror.states['light.office']['state'] == 'off')
+    run_with_mirror(test)
+
+def test_authentication_failure():
+    async def run():
+        stub = HomeAssistantStub()
+        runner, base_url = await start_stub(stub)
+        mirror = homeassistant.StateMirror(base_url, 'wrong', reconnect_interval=0.05)
+        try:
+            try:
+                await mirror.connect()
+            except Exception as e:
+                assert 'authentication failed' in str(e)
+            else:
+                raise AssertionError("connected with a wrong token")
+            assert not mirror.ready.is_set()
+        finally:
+            await runner.cleanup()
+    asyncio.run(run())
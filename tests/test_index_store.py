@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from document_index import DocumentSegment
+from index_store import SegmentStore
+
+plugin_key = ("calendar", "0123456789abcdef0123")
+
+def get_segment():
+    return DocumentSegment("calendar", [
+        {"title": "Events this week", "embedding": [3.0, 4.0], "events": ["dentist"]},
+        {"title": "Birthdays", "embedding": None, "events": []}
+    ])
+
+def test_round_trip(tmp_path):
+    store = SegmentStore(str(tmp_path), "model")
+    store.save(plugin_key, "1", get_segment(), 1000.0)
+    segment, updated = store.load(plugin_key, "calendar", "1", memory_map=True)
+    assert updated == 1000.0
+    assert [document['title'] for document in segment.documents] == ["Events this week", "Birthdays"]
+    assert segment.documents[0]['events'] == ["dentist"]
+    assert list(segment.embedded) == [0]
+    assert isinstance(segment.matrix, np.memmap)
+    assert segment.matrix[0] == pytest.approx([0.6, 0.8])
+
+def test_new_versions_replace_old_ones(tmp_path):
+    store = SegmentStore(str(tmp_path), "model")
+    store.save(plugin_key, "1", get_segment(), 1000.0)
+    version = store.get_version(plugin_key)
+    store.save(plugin_key, "1", DocumentSegment("calendar", [{"title": "Nothing", "embedding": [1.0, 0.0]}]), 2000.0)
+    assert store.get_version(plugin_key) != version
+    segment, updated = store.load(plugin_key, "calendar", "1")
+    assert updated == 2000.0
+    assert [document['title'] for document in segment.documents] == ["Nothing"]
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+
+def test_other_versions_are_ignored(tmp_path):
+    SegmentStore(str(tmp_path), "model").save(plugin_key, "1", get_segment(), 1000.0)
+    # a different version of the plugin may expect different documents
+    assert SegmentStore(str(tmp_path), "model").load(plugin_key, "calendar", "2") is None
+    assert SegmentStore(str(tmp_path), "other model").load(plugin_key, "calendar", "1") is None
+    assert SegmentStore(str(tmp_path), "model").load(("calendar", "fedcba9876543210"), "calendar", "1") is None
+    assert SegmentStore(str(tmp_path), "model").load(plugin_key, "calendar", "1") is not None
@@ -0,0 +1,39 @@
+from keyword_router import KeywordRouter
+
+def build_router(keywords):
+    router = KeywordRouter()
+    for keyword, value in keywords:
+        router.add(keyword, value)
+    router.build()
+    return router
+
+def test_whole_words_only():
+    router = build_router([("den", "den"), ("office", "office")])
+    assert router.search("water the garden") == []
+    assert router.search("Turn off the DEN lights!") == ["den"]
+    assert router.search("office") == ["office"]
+
+def test_short_keywords_are_ignored():
+    router = build_router([("tv", "tv"), ("kitchen", "kitchen")])
+    assert len(router) == 1
+    assert router.search("turn on the tv in the kitchen") == ["kitchen"]
+
+def test_longest_of_overlapping_keywords():
+    router = build_router([("kitchen", "kitchen"), ("kitchen speaker", "speaker"), ("speaker", "any speaker")])
+    assert router.search("play music on the kitchen speaker") == ["speaker"]
+    assert router.search("is the kitchen light on") == ["kitchen"]
+
+def test_partially_overlapping_keywords():
+    # "living room" and "room light" share "room", only the longer one is used
+    router = build_router([("living room", "living room"), ("room light", "room light")])
+    assert router.search("turn on the living room light") == ["living room"]
+
+def test_adjacent_keywords():
+    # neighbouring keywords only share the space between them, which doesn't count as overlapping
+    router = build_router([("office", "office"), ("kitchen", "kitchen"), ("living room", "living room")])
+    assert router.search("office kitchen living room") == ["office", "kitchen", "living room"]
+    assert router.search("kitchen, office") == ["kitchen", "office"]
+
+def test_repeated_keywords_and_shared_values():
+    router = build_router([("office", "office"), ("study", "office")])
+    assert router.search("office or study, the office") == ["office", "office", "office"]
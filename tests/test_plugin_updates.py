@@ -0,0 +1,80 @@
+import asyncio
+import json
+import numpy as np
+import pytest
+import main
+
+class Adapter:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def update(self):
+        pass
+
+    def get_documents(self):
+        return self.documents
+
+def get_plugin(documents):
+    return {"name": "test", "key": ("test", "hash"), "version": "1", "class": Adapter(documents), "config": {}, "segment": None, "updated": None, "error": None}
+
+@pytest.fixture(autouse=True)
+def plugins(monkeypatch):
+    monkeypatch.setattr(main, 'plugin_instances', {})
+    monkeypatch.setattr(main, 'plugins', [])
+
+def test_embeddings_are_only_kept_by_the_index():
+    documents = [{"title": "Office lights", "embedding": np.array([1.0, 0.0], dtype=np.float32)}]
+    plugin = get_plugin(documents)
+    main.run_plugin_update(plugin)
+    assert documents == [{"title": "Office lights"}]
+    assert plugin['segment'].documents == [{"title": "Office lights"}]
+    assert len(plugin['segment'].embedded) == 1
+    # a plugin returning the same documents again keeps their embeddings
+    main.run_plugin_update(plugin)
+    assert plugin['error'] is None
+    assert plugin['segment'].matrix[0] == pytest.approx([1.0, 0.0])
+
+def test_missing_embeddings_fail_the_update():
+    plugin = get_plugin([{"title": "Office lights", "embedding": None}])
+    with pytest.raises(Exception, match="1 documents could not be embedded"):
+        main.run_plugin_update(plugin)
+    # published anyway, as there was nothing before
+    assert plugin['segment'].documents == [{"title": "Office lights"}]
+    assert plugin['error'] == "1 documents could not be embedded"
+    plugin['class'].documents = [{"title": "Office lights", "embedding": [1.0, 0.0]}]
+    main.run_plugin_update(plugin)
+    assert plugin['error'] is None
+    segment = plugin['segment']
+    plugin['class'].documents = [{"title": "Kitchen lights", "embedding": None}]
+    with pytest.raises(Exception):
+        main.run_plugin_update(plugin)
+    assert plugin['segment'] is segment
+
+def test_api_workers_report_failed_updates(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'api_workers', 2)
+    monkeypatch.setattr(main, 'plugin_statuses_path', str(tmp_path / 'plugin_statuses.json'), raising=False)
+    plugin = get_plugin([{"title": "Office lights", "embedding": [1.0, 0.0]}])
+    monkeypatch.setitem(main.plugin_instances, plugin['key'], plugin)
+    main.run_plugin_update(plugin)
+    plugin['class'].documents = [{"title": "Office lights", "embedding": None}]
+    with pytest.raises(Exception):
+        main.run_plugin_update(plugin)
+    # an API worker with the same documents, which never updated the plugin itself
+    monkeypatch.setattr(main, 'worker_mode', True)
+    plugin['error'] = None
+    response = asyncio.run(main.ready_endpoint(None))
+    status = json.loads(response.body)['plugins'][0]
+    assert status['stale'] is True
+    assert status['error'] == "1 documents could not be embedded"
+
+def test_get_documents_failing_fails_the_update():
+    plugin = get_plugin([{"title": "Office lights", "embedding": [1.0, 0.0]}])
+    main.run_plugin_update(plugin)
+    segment = plugin['segment']
+    def get_documents():
+        raise KeyError('events')
+    plugin['class'].get_documents = get_documents
+    with pytest.raises(Exception, match="Error getting documents: 'events'"):
+        main.run_plugin_update(plugin)
+    assert plugin['error'] == "Error getting documents: 'events'"
+    assert plugin['segment'] is segment
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+import main
+from document_index import DocumentSegment, DocumentIndex
+
+EXAMPLES_HEADER = '\n\n\nFind examples below. Reword the answers to fit your personality. Prompts are given as Q: and the example answers are given as A:\n\n'
+
+class Adapter:
+    def __init__(self, sections):
+        self.sections = sections
+
+    def get_llm_prompt_addition(self, document, user_prompt):
+        return self.sections[document['title']]
+
+@pytest.fixture
+def assemble(monkeypatch):
+    # routes prompts by keyword, so the documents are selected in the order their keywords appear in the prompt
+    def assemble(sections, prompt, token_budget, include_examples=True):
+        plugin = {"name": "test", "key": ("test", "hash"), "class": Adapter(sections)}
+        segment = DocumentSegment("test", [{"title": title, "keywords": [title], "embedding": None} for title in sections])
+        monkeypatch.setattr(main, 'plugins', [plugin])
+        monkeypatch.setattr(main, 'document_snapshot', {"version": 1, "created": None, "indexes": {None: DocumentIndex([segment])}})
+        monkeypatch.setattr(main, 'last_prompt_additions', main.OrderedDict())
+        monkeypatch.setitem(main.config, 'keyword_routing_enabled', True)
+        monkeypatch.setitem(main.config, 'number_of_results', len(sections))
+        monkeypatch.setitem(main.config, 'prompt_token_budget', token_budget)
+        monkeypatch.setitem(main.config, 'include_examples', include_examples)
+        llm_prompt, degraded = asyncio.run(main.process_prompt(prompt, None))
+        assert degraded == []
+        return llm_prompt
+    return assemble
+
+def count(text):
+    return main.token_counter.count(text)
+
+def test_without_budget(assemble):
+    sections = {
+        "kitchen": {"prompt": "Kitchen light is on.", "examples": [("Turn it off", "Done")]},
+        "office": {"prompt": "Office light is off.\n", "examples": []}
+    }
+    llm_prompt = assemble(sections, "kitchen and office", None)
+    assert llm_prompt == "Kitchen light is on.\n\n\nOffice light is off." + EXAMPLES_HEADER + "Q:Turn it off\nA:Done"
+
+def test_sections_that_do_not_fit_are_dropped(assemble):
+    sections = {
+        "kitchen": {"prompt": "Kitchen light is on.", "examples": []},
+        "office": {"prompt": "Office light is off and a lot more text that does not fit. " * 5, "examples": [("Office example", "Dropped")]},
+        "garage": {"prompt": "Garage is closed.", "examples": []}
+    }
+    budget = count("Kitchen light is on.\n\n\n") + count("Garage is closed.\n\n\n")
+    llm_prompt = assemble(sections, "kitchen office garage", budget)
+    # a less relevant section that fits is still used, the examples of the one that didn't are not
+    assert llm_prompt == "Kitchen light is on.\n\n\nGarage is closed."
+
+def test_first_section_is_truncated_line_by_line(assemble):
+    sections = {
+        "kitchen": {"prompt": "Kitchen light is on.\nKitchen fan is off.\nKitchen oven is heating up to 200 degrees.", "examples": []}
+    }
+    budget = count("Kitchen light is on.\n") + count("Kitchen fan is off.\n")
+    assert assemble(sections, "kitchen", budget) == "Kitchen light is on.\nKitchen fan is off."
+
+def test_first_section_truncated_to_nothing(assemble):
+    sections = {
+        "kitchen": {"prompt": "Kitchen light is on and this first line is much too long for the budget. " * 3, "examples": [("Kitchen example", "Dropped")]},
+        "office": {"prompt": "Office is off.", "examples": [("Hi", "Ok")]}
+    }
+    budget = count("Office is off.\n\n\n") + count(EXAMPLES_HEADER) + count("Q:Hi\nA:Ok\n\n")
+    # neither the section nor its examples are used, the next section is the first one instead
+    llm_prompt = assemble(sections, "kitchen office", budget)
+    assert llm_prompt == "Office is off." + EXAMPLES_HEADER + "Q:Hi\nA:Ok"
+    # without room for the header, there are no examples and no header
+    assert assemble(sections, "kitchen office", budget - 1) == "Office is off."
+
+def test_examples_header_is_only_charged_once(assemble):
+    sections = {
+        "kitchen": {"prompt": "Kitchen.", "examples": [("One", "1"), ("A much longer example question that does not fit", "No"), ("Two", "2")]}
+    }
+    budget = count("Kitchen.\n\n\n") + count(EXAMPLES_HEADER) + count("Q:One\nA:1\n\n") + count("Q:Two\nA:2\n\n")
+    assert assemble(sections, "kitchen", budget) == "Kitchen." + EXAMPLES_HEADER + "Q:One\nA:1\n\nQ:Two\nA:2"
+    assert assemble(sections, "kitchen", budget, include_examples=False) == "Kitchen."
@@ -0,0 +1,93 @@
+import threading
+import time
+import pytest
+from scheduler import UpdateScheduler
+
+class Plugin:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.updates = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def update(self, timeout):
+        self.updates += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.errors:
+            raise Exception(self.errors.pop(0))
+
+def run_update(plugin, timeout):
+    plugin.update(timeout)
+
+def test_success_schedules_the_next_interval():
+    scheduler = UpdateScheduler(run_update, 2)
+    plugin = Plugin()
+    scheduler.add('key', 'plugin', plugin, interval=100)
+    result = scheduler.run_now()['key'].result(5)
+    assert result['error'] is None
+    assert scheduler.jobs['key']['next_run'] - time.monotonic() == pytest.approx(100, abs=1)
+
+def test_failures_back_off_up_to_the_interval():
+    scheduler = UpdateScheduler(run_update, 2)
+    plugin = Plugin(errors=["down", "", "down", "down", "down"])
+    scheduler.add('key', 'plugin', plugin, interval=50, retry_delay=10)
+    delays = []
+    for _ in range(5):
+        result = scheduler.run_now()['key'].result(5)
+        # exceptions without a message are reported by their type
+        assert result['error']
+        delays.append(scheduler.jobs['key']['next_run'] - time.monotonic())
+    assert delays == pytest.approx([10, 20, 40, 50, 50], abs=1)
+    assert scheduler.jobs['key']['failures'] == 5
+    assert scheduler.run_now()['key'].result(5)['error'] is None
+    assert scheduler.jobs['key']['failures'] == 0
+
+def test_run_now_while_updating_returns_the_running_update_and_runs_again():
+    scheduler = UpdateScheduler(run_update, 2)
+    plugin = Plugin()
+    plugin.release.clear()
+    scheduler.add('key', 'plugin', plugin, interval=100)
+    first = scheduler.run_now()['key']
+    assert plugin.started.wait(5)
+    assert scheduler.run_now(['key'])['key'] is first
+    plugin.release.set()
+    first.result(5)
+    assert plugin.updates == 1
+    assert scheduler.jobs['key']['next_run'] <= time.monotonic()
+    assert scheduler.jobs['key']['run_again'] is None
+
+def test_schedule_while_updating_keeps_the_shortest_delay():
+    scheduler = UpdateScheduler(run_update, 2)
+    plugin = Plugin()
+    plugin.release.clear()
+    scheduler.add('key', 'plugin', plugin, interval=100)
+    future = scheduler.run_now()['key']
+    assert plugin.started.wait(5)
+    scheduler.schedule('key', 30)
+    scheduler.schedule('key', 5)
+    scheduler.schedule('key', 60)
+    plugin.release.set()
+    future.result(5)
+    assert scheduler.jobs['key']['next_run'] - time.monotonic() == pytest.approx(5, abs=1)
+
+def test_scheduled_updates_run_and_time_out():
+    timed_out = []
+    scheduler = UpdateScheduler(run_update, 2, on_timeout=timed_out.append)
+    plugin = Plugin()
+    plugin.release.clear()
+    scheduler.add('key', 'plugin', plugin, interval=100, timeout=0.1)
+    scheduler.start()
+    scheduler.schedule('key', 0.05)
+    assert plugin.started.wait(5)
+    for _ in range(100):
+        if timed_out:
+            break
+        time.sleep(0.01)
+    assert timed_out == [plugin]
+    # finishing late still counts as a failure
+    with scheduler.condition:
+        future = scheduler.jobs['key']['future']
+    plugin.release.set()
+    assert 'did not finish within 0.1 seconds' in future.result(5)['error']
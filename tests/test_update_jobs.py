@@ -0,0 +1,26 @@
+from concurrent.futures import Future
+import main
+
+class Scheduler:
+    def __init__(self, futures):
+        self.futures = futures
+
+    def run_now(self, keys=None):
+        return self.futures
+
+def test_job_finishes_with_its_last_plugin(monkeypatch):
+    # the first plugin is already done when the job starts, e.g. as it was updating anyway
+    finished = Future()
+    finished.set_result({"duration": 0.1, "error": None})
+    running = Future()
+    monkeypatch.setattr(main, 'update_scheduler', Scheduler({("first", "hash"): finished, ("second", "hash"): running}))
+    job = main.start_update_job((("first", "hash"), ("second", "hash")))
+    status = main.get_update_job_status(job['id'], job)
+    assert status['status'] == 'running'
+    assert status['finished'] is None
+    assert [plugin['status'] for plugin in status['plugins']] == ['done', 'running']
+    running.set_result({"duration": 0.2, "error": "down"})
+    status = main.get_update_job_status(job['id'], job)
+    assert status['status'] == 'failed'
+    assert status['completed'] == 2
+    assert status['finished'] is not None
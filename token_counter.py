@@ -0,0 +1,36 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+class TokenCounter:
+    # counts tokens with a local tokenizer.json (from the `tokenizers` package) if one is configured
+    # and otherwise estimates them from the number of characters
+    def __init__(self, tokenizer_path=None, characters_per_token=4):
+        self.characters_per_token = characters_per_token
+        self.tokenizer = None
+        if tokenizer_path:
+            try:
+                from tokenizers import Tokenizer
+                self.tokenizer = Tokenizer.from_file(tokenizer_path)
+            except ImportError:
+                logger.error("tokenizer_path is set but the tokenizers package is not installed, estimating tokens from characters instead")
+            except Exception as e:
+                logger.error(f"Could not load tokenizer from {tokenizer_path}, estimating tokens from characters instead: {str(e)}")
+
+    def count(self, text):
+        if self.tokenizer:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return math.ceil(len(text) / self.characters_per_token)
+
+    def truncate(self, text, max_tokens):
+        # keeps as many whole lines as fit, so we never cut an entity or an event in half
+        lines = []
+        used_tokens = 0
+        for line in text.split('\n'):
+            line_tokens = self.count(line + '\n')
+            if used_tokens + line_tokens > max_tokens:
+                break
+            lines.append(line)
+            used_tokens += line_tokens
+        return '\n'.join(lines).strip()